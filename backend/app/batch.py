@@ -0,0 +1,197 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from app.logger import logger
+from mcp_agent.agents.counterfactual import normalize_counterfactual_spec
+
+LAYERS = ("lst", "uhi", "counterfactual_uhi", "delta_uhi")
+BATCH_FORMATS = ("npz",)
+# Upper bound on worker processes; one pool of this size is shared by all batches.
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", os.cpu_count() or 1))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def check_batch_format(fmt: str):
+    if fmt not in BATCH_FORMATS:
+        raise ValueError(f"Unsupported batch output format: {fmt}, expected one of {BATCH_FORMATS}")
+
+
+def get_batch_pool() -> ProcessPoolExecutor:
+    """
+    Process pool shared by every batch in this process. Workers stay up,
+    so each loads the model once rather than once per batch. They are
+    spawned, not forked: forking would copy the running API process
+    (its busy threads, the FastAPI app and the MCP client).
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=BATCH_MAX_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _record_changes(record: dict) -> list:
+    return normalize_counterfactual_spec(
+        record.get("feature_name"), record.get("change_value"), record.get("changes")
+    )
+
+
+def analyze_record(record: dict, include_grids: bool = False, quality: str = "full", region: tuple = None) -> dict:
+    """
+    Runs the analysis core for one {lat, lon, feature_name?, change_value?,
+    changes?, quality?} record. Errors are reported per record instead of
+    failing the whole batch. `region` is the record's precomputed
+    (window, bbox).
+    """
+    # imported lazily so the model is loaded in the worker, not the API process
+    from mcp_agent.server.geocode import run_uhi_analysis
+
+    row = {"lat": float(record["lat"]), "lon": float(record["lon"]), "error": ""}
+    try:
+        result = run_uhi_analysis(
+            row["lat"], row["lon"], _record_changes(record), record.get("quality", quality), region
+        )
+    except Exception as e:
+        row["error"] = str(e)
+        return {"summary": row, "grids": None}
+
+    row["min_lon"], row["min_lat"], row["max_lon"], row["max_lat"] = result["bbox"]
+    for name in LAYERS:
+        arr = result[name]
+        has_data = arr is not None and np.isfinite(arr).any()
+        row[f"{name}_mean"] = float(np.nanmean(arr)) if has_data else np.nan
+        row[f"{name}_min"] = float(np.nanmin(arr)) if has_data else np.nan
+        row[f"{name}_max"] = float(np.nanmax(arr)) if has_data else np.nan
+
+    grids = None
+    if include_grids:
+        grids = {name: np.asarray(result[name], dtype=np.float32)
+                 for name in LAYERS if result[name] is not None}
+    return {"summary": row, "grids": grids}
+
+
+def _analyze_chunk(args):
+    from mcp_agent.server.geocode import resolve_windows
+
+    records, include_grids, quality = args
+    # one vectorized call resolves the windows of the whole chunk
+    regions = resolve_windows([float(r["lat"]) for r in records], [float(r["lon"]) for r in records])
+    return [analyze_record(record, include_grids, quality, region) for record, region in zip(records, regions)]
+
+
+def run_batch(records: list, workers: int = None, include_grids: bool = False, chunk_size: int = 16,
+              quality: str = "full") -> list:
+    """
+    Analyzes many locations in parallel across processes, without the LLM.
+    Records are handled in chunks on the shared pool, always outside the
+    calling process; `workers` (capped at BATCH_MAX_WORKERS) sets how many
+    chunks of this batch run at once. `quality` is the default model tier
+    for records that don't set one.
+    """
+    workers = min(workers or BATCH_MAX_WORKERS, BATCH_MAX_WORKERS)
+    chunk_size = max(1, min(chunk_size, -(-len(records) // workers)))
+    chunks = [(records[i:i + chunk_size], include_grids, quality) for i in range(0, len(records), chunk_size)]
+    logger.info(f"batch: {len(records)} records, {len(chunks)} chunks, {workers} workers")
+
+    pool = get_batch_pool()
+    results = [None] * len(chunks)
+    running = {}
+    for i, chunk in enumerate(chunks):
+        if len(running) >= workers:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+        running[pool.submit(_analyze_chunk, chunk)] = i
+    for future, i in running.items():
+        results[i] = future.result()
+    return [r for chunk in results for r in chunk]
+
+
+def _stack_grids(results: list) -> dict:
+    """Stacks per-record grids into (N, H, W) arrays, NaN-padded to the largest window."""
+    shapes = [next(iter(r["grids"].values())).shape if r["grids"] else (0, 0) for r in results]
+    H = max((s[0] for s in shapes), default=0)
+    W = max((s[1] for s in shapes), default=0)
+
+    stacked = {"grid_shape": np.asarray(shapes, dtype=np.int32).reshape(len(results), 2)}
+    for name in LAYERS:
+        if not any(r["grids"] and name in r["grids"] for r in results):
+            continue
+        out = np.full((len(results), H, W), np.nan, dtype=np.float32)
+        for i, r in enumerate(results):
+            if r["grids"] and name in r["grids"]:
+                h, w = r["grids"][name].shape
+                out[i, :h, :w] = r["grids"][name]
+        stacked[f"grid_{name}"] = out
+    return stacked
+
+
+def write_batch_output(results: list, out, fmt: str = "npz"):
+    """
+    Writes batch results as one columnar npz file (path or binary
+    stream): one array per summary column plus optional grids.
+    """
+    check_batch_format(fmt)
+    summaries = [r["summary"] for r in results]
+    columns = sorted({key for row in summaries for key in row}, key=lambda k: (k not in ("lat", "lon"), k))
+
+    arrays = {}
+    for col in columns:
+        values = [row.get(col, np.nan if col != "error" else "") for row in summaries]
+        arrays[col] = np.asarray(values, dtype=str if col == "error" else np.float64)
+    if any(r["grids"] for r in results):
+        arrays.update(_stack_grids(results))
+    np.savez_compressed(out, **arrays)
+    return out
+
+
+def batch_to_bytes(results: list, fmt: str = "npz") -> bytes:
+    buffer = io.BytesIO()
+    write_batch_output(results, buffer, fmt)
+    return buffer.getvalue()
+
+
+def load_records(path: str) -> list:
+    """Reads records from a .json list, .jsonl or .csv (lat, lon, feature_name, type, value)."""
+    if path.endswith(".jsonl"):
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    if path.endswith(".json"):
+        with open(path) as f:
+            return json.load(f)
+
+    records = []
+    for row in pd.read_csv(path).to_dict("records"):
+        record = {"lat": row["lat"], "lon": row["lon"]}
+        if isinstance(row.get("feature_name"), str) and not pd.isna(row.get("value")):
+            record["feature_name"] = row["feature_name"]
+            record["change_value"] = {"type": row.get("type", "multiply"), "value": float(row["value"])}
+        records.append(record)
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch UHI analysis for many locations")
+    parser.add_argument("records", help="input .csv, .json or .jsonl")
+    parser.add_argument("output", help="output .npz")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--grids", action="store_true", help="include per-location grids")
+    parser.add_argument("--quality", choices=("preview", "full"), default="full")
+    args = parser.parse_args()
+
+    results = run_batch(load_records(args.records), workers=args.workers, include_grids=args.grids,
+                        quality=args.quality)
+    write_batch_output(results, args.output)
+    logger.info(f"wrote {len(results)} results to {args.output}")
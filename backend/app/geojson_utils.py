@@ -1,5 +1,9 @@
+import base64
+import json
+import struct
 import numpy as np
 from shapely.geometry import box, mapping
+from app.result_store import quantize_int16, INT16_NODATA
 
 def ndarrays_to_geojson(data_dict):
     import numpy as np
@@ -61,3 +65,87 @@ def format_backend_response(geojson_fc):
     return {
         "geojson": geojson_fc
     }
+
+
+GRID_LAYERS = ("lst", "uhi", "counterfactual_uhi", "delta_uhi")
+GRID_JSON_MEDIA_TYPE = "application/vnd.urbanhcf.grid+json"
+GRID_BINARY_MEDIA_TYPE = "application/vnd.urbanhcf.grid"
+GRID_MAGIC = b"UHCF"
+
+
+def ndarrays_to_grid(data_dict, encoding="float32"):
+    """
+    Compact alternative to ndarrays_to_geojson for a regular grid:
+    bbox + shape + one base64 array per layer (row-major, north-up).
+
+    encoding: "float32" (little-endian, NaN for missing) or "int16"
+    (value = (q + 32767) * scale + offset, q == nodata for missing).
+    """
+    layers = {}
+    shape = None
+    for name in GRID_LAYERS:
+        arr = data_dict.get(name)
+        if arr is None:
+            continue
+        arr = np.asarray(arr, dtype="<f4")
+        shape = list(arr.shape)
+
+        if encoding == "int16":
+            quantized, scale, offset = quantize_int16(arr)
+            layers[name] = {
+                "dtype": "int16",
+                "scale": scale,
+                "offset": offset,
+                "nodata": INT16_NODATA,
+                "data": base64.b64encode(quantized.astype("<i2").tobytes()).decode("ascii"),
+            }
+        elif encoding == "float32":
+            layers[name] = {
+                "dtype": "float32",
+                "data": base64.b64encode(arr.tobytes()).decode("ascii"),
+            }
+        else:
+            raise ValueError(f"Unsupported grid encoding: {encoding}")
+
+    return {
+        "type": "Grid",
+        "bbox": data_dict.get("bbox"),
+        "shape": shape,
+        "layers": layers,
+    }
+
+
+def ndarrays_to_grid_binary(data_dict):
+    """
+    Binary grid body: b"UHCF" + uint32 header length + JSON header, padded
+    to 4 bytes, then raw little-endian float32 layers in header order.
+    Each header layer entry carries its byte offset into the body.
+    """
+    arrays = []
+    shape = None
+    for name in GRID_LAYERS:
+        arr = data_dict.get(name)
+        if arr is None:
+            continue
+        arr = np.ascontiguousarray(arr, dtype="<f4")
+        shape = list(arr.shape)
+        arrays.append((name, arr))
+
+    def build_header(base):
+        offset = base
+        entries = []
+        for name, arr in arrays:
+            entries.append({"name": name, "dtype": "float32", "offset": offset})
+            offset += arr.nbytes
+        return json.dumps({"bbox": data_dict.get("bbox"), "shape": shape, "layers": entries}).encode("utf-8")
+
+    # header length changes the data offsets, so size it once then fix up
+    header = build_header(0)
+    base = len(GRID_MAGIC) + 4 + len(header) + 64
+    base += (-base) % 4
+    header = build_header(base)
+    padding = base - (len(GRID_MAGIC) + 4 + len(header))
+
+    parts = [GRID_MAGIC, struct.pack("<I", len(header) + padding), header, b" " * padding]
+    parts.extend(arr.tobytes() for _, arr in arrays)
+    return b"".join(parts)
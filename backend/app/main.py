@@ -1,8 +1,10 @@
 from dotenv import load_dotenv
 load_dotenv()
-from fastapi import FastAPI
+from fastapi import FastAPI, Query, Response, BackgroundTasks, Request
+from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from mcp_use import MCPAgent, MCPClient
 import json
 import os
@@ -10,11 +12,24 @@ import numpy as np
 import shutil
 import pickle
 import uuid
+import tempfile
 from app.logger import logger
 import traceback
 from app.redis_client import get_redis_client
+from app.result_store import get_result_store
+from utils import export_results_tiff
 from mcp_agent.mcp_service import UrbanHCFMCPService
-from app.geojson_utils import ndarrays_to_geojson, format_backend_response
+from app.geojson_utils import (
+    ndarrays_to_geojson,
+    format_backend_response,
+    ndarrays_to_grid,
+    ndarrays_to_grid_binary,
+    GRID_JSON_MEDIA_TYPE,
+    GRID_BINARY_MEDIA_TYPE,
+)
+from app.batch import BATCH_MAX_WORKERS, check_batch_format, run_batch, batch_to_bytes
+from mcp_agent.server.ranking import MAX_TOP_K, get_ranking_index
+from mcp_agent.server.baseline import MAX_POINT_RADIUS, load_baseline_grid, point_records, preload_shared_state
 
 REDIS_URL = os.getenv("REDIS_URL")
 app = FastAPI()
@@ -30,6 +45,33 @@ app.add_middleware(
 class QueryRequest(BaseModel):
     query: str
 
+class BatchRecord(BaseModel):
+    lat: float
+    lon: float
+    feature_name: Optional[str] = None
+    change_value: Optional[dict] = None
+    changes: Optional[List[dict]] = None
+    quality: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    records: List[BatchRecord]
+    include_grids: bool = False
+    format: str = "npz"
+    workers: Optional[int] = Field(None, ge=1, le=BATCH_MAX_WORKERS)
+    quality: str = "full"
+
+class RankRequest(BaseModel):
+    k: int = Field(10, ge=1, le=MAX_TOP_K)
+    layer: str = "uhi"
+    bbox: Optional[List[float]] = None
+    polygon: Optional[dict] = None
+    ascending: bool = False
+
+class PointsRequest(BaseModel):
+    lats: List[float]
+    lons: List[float]
+    radius: int = Field(3, ge=1, le=MAX_POINT_RADIUS)
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
@@ -66,12 +108,95 @@ async def analyze(request: QueryRequest):
         logger.error(traceback.format_exc())
         raise
 
+@app.post("/batch")
+def batch(request: BatchRequest):
+    """
+    Runs the analysis core for many locations without the LLM and returns
+    one columnar npz file.
+    """
+    try:
+        check_batch_format(request.format)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+
+    records = [record.model_dump(exclude_none=True) for record in request.records]
+    results = run_batch(
+        records, workers=request.workers, include_grids=request.include_grids, quality=request.quality
+    )
+    body = batch_to_bytes(results, request.format)
+    return Response(
+        content=body,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f"attachment; filename=uhi_batch.{request.format}"},
+    )
+
+@app.post("/rank")
+def rank(request: RankRequest):
+    """
+    Top-k cells of a baseline layer inside a bbox and/or GeoJSON polygon.
+    """
+    try:
+        cells = get_ranking_index().top_k(
+            request.layer, request.k, bbox=request.bbox, polygon=request.polygon, ascending=request.ascending
+        )
+        return {"layer": request.layer, "cells": cells}
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+
+@app.get("/point")
+def point(lat: float, lon: float, radius: int = Query(3, ge=1, le=MAX_POINT_RADIUS)):
+    """
+    Baseline LST/UHI at a coordinate plus neighborhood stats.
+    """
+    result = load_baseline_grid().query_points(lat, lon, radius)
+    return point_records(lat, lon, result)[0]
+
+@app.post("/points")
+def points(request: PointsRequest):
+    if len(request.lats) != len(request.lons):
+        return {"status": "error", "message": "lats and lons must have the same length"}
+    result = load_baseline_grid().query_points(request.lats, request.lons, request.radius)
+    return {"points": point_records(request.lats, request.lons, result)}
+
+@app.get("/results/{run_id}.tif")
+def get_results_tiff(run_id: str, background_tasks: BackgroundTasks):
+    """
+    Downloads a run's layers as a tiled, compressed multi-band GeoTIFF.
+    """
+    payload = get_result_store(REDIS_URL).get(run_id)
+    if payload is None:
+        return {"status": "error", "message": f"run {run_id} not found"}
+
+    fd, path = tempfile.mkstemp(suffix=".tif")
+    os.close(fd)
+    background_tasks.add_task(os.remove, path)
+    export_results_tiff(path, payload)
+    return FileResponse(path, media_type="image/tiff", filename=f"uhi_{run_id}.tif")
+
 @app.get("/results/{run_id}")
-def get_results(run_id: str):
+def get_results(run_id: str, request: Request, format: Optional[str] = None, encoding: str = "float32"):
+    """
+    Content-negotiated results:
+    - default: per-cell GeoJSON FeatureCollection
+    - Accept: application/vnd.urbanhcf.grid+json (or ?format=grid):
+      bbox + shape + base64 layers, float32 or ?encoding=int16
+    - Accept: application/vnd.urbanhcf.grid or application/octet-stream
+      (or ?format=binary): binary header + raw float32 layers
+    """
     try:
-        redis_client = get_redis_client(REDIS_URL)
-        payload_str = redis_client.get(f"uhi:{run_id}")
-        payload = json.loads(payload_str)
+        payload = get_result_store(REDIS_URL).get(run_id)
+        if payload is None:
+            return {"status": "error", "message": f"run {run_id} not found"}
+
+        accept = {part.split(";")[0].strip() for part in request.headers.get("accept", "").split(",")}
+        if format == "binary" or accept & {GRID_BINARY_MEDIA_TYPE, "application/octet-stream"}:
+            return Response(content=ndarrays_to_grid_binary(payload), media_type=GRID_BINARY_MEDIA_TYPE)
+        if format == "grid" or GRID_JSON_MEDIA_TYPE in accept:
+            return Response(
+                content=json.dumps({"grid": ndarrays_to_grid(payload, encoding)}),
+                media_type=GRID_JSON_MEDIA_TYPE,
+            )
+
         lst = payload['lst']
         uhi = payload['uhi']
         counterfactual_uhi = payload['counterfactual_uhi']
@@ -93,6 +218,27 @@ def get_results(run_id: str):
         # Return a safe error to frontend
         return {"status": "error", "message": str(e)}
 
+@app.get("/results/{run_id}/stats")
+def get_result_stats(run_id: str):
+    stats = get_result_store(REDIS_URL).stats(run_id)
+    if stats is None:
+        return {"status": "error", "message": f"run {run_id} not found"}
+    return stats
+
+@app.get("/metrics/results")
+def result_metrics():
+    try:
+        return get_result_store(REDIS_URL).metrics()
+    except Exception as e:
+        return {"status": "fail", "error": str(e)}
+
+@app.on_event("startup")
+def startup_event():
+    try:
+        preload_shared_state()
+    except Exception as e:
+        logger.warning(f"shared state preload failed, workers will read rasters directly: {e}")
+
 @app.on_event("shutdown")
 async def shutdown_event():
     await mcp_service.shutdown()
@@ -0,0 +1,120 @@
+import os
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+from app.logger import logger
+
+# "float64" keeps the original precision; "float32" halves the per-request
+# working set (pixel matrix, predictions and UHI layers).
+PIPELINE_DTYPE = os.getenv("PIPELINE_DTYPE", "float64")
+# Per-request cap on the estimated working set, 0 disables it.
+REQUEST_MEMORY_BUDGET_MB = float(os.getenv("REQUEST_MEMORY_BUDGET_MB", 0))
+# What to do with requests over the cap: "tile" predicts in row tiles, "reject" raises.
+REQUEST_MEMORY_POLICY = os.getenv("REQUEST_MEMORY_POLICY", "tile")
+# Opt-in: measure each request's traced peak with tracemalloc (~7% slower).
+REQUEST_MEMORY_TRACE = os.getenv("REQUEST_MEMORY_TRACE", "0") == "1"
+
+# LightGBM always returns float64 predictions
+_PREDICT_ITEMSIZE = 8
+
+# measurements in flight; tracemalloc runs while any is active
+_trace_lock = threading.Lock()
+_active_traces = 0
+_owns_trace = False
+
+
+def pipeline_dtype(dtype=None) -> np.dtype:
+    dtype = np.dtype(dtype or PIPELINE_DTYPE)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError(f"Unsupported pipeline dtype '{dtype}', expected float32 or float64")
+    return dtype
+
+
+def estimate_analysis_bytes(height, width, num_bands, dtype, counterfactual=False, chunk_rows=None) -> int:
+    """
+    Estimated working set of one analysis: the feature window, the pixel
+    matrix and predictions for one tile of `chunk_rows` rows (all rows by
+    default), and the output layers.
+    """
+    itemsize = np.dtype(dtype).itemsize
+    pixels = height * width
+    tile_pixels = (height if chunk_rows is None else min(chunk_rows, height)) * width
+
+    features = num_bands * pixels * 4  # float32 raster window
+    tile = tile_pixels * ((num_bands - 1) * itemsize + _PREDICT_ITEMSIZE)
+    layers = (5 if counterfactual else 2) * pixels * itemsize
+    return features + tile + layers
+
+
+def plan_chunk_rows(height, width, num_bands, dtype, counterfactual=False, budget_mb=None, policy=None):
+    """
+    Rows per prediction tile that keep the estimated working set within
+    the budget. Returns None when the whole window fits (or there is no
+    budget); raises ValueError when the request cannot fit, or when the
+    policy is "reject" and it does not fit untiled.
+    """
+    budget_mb = REQUEST_MEMORY_BUDGET_MB if budget_mb is None else budget_mb
+    policy = policy or REQUEST_MEMORY_POLICY
+    if not budget_mb or height == 0:
+        return None
+
+    budget = budget_mb * 2**20
+    estimate = estimate_analysis_bytes(height, width, num_bands, dtype, counterfactual)
+    if estimate <= budget:
+        return None
+
+    too_large = ValueError(
+        f"request needs ~{estimate / 2**20:.1f} MB for a {height}x{width} window, "
+        f"over the {budget_mb:g} MB budget"
+    )
+    if policy == "reject":
+        raise too_large
+
+    fixed = estimate_analysis_bytes(height, width, num_bands, dtype, counterfactual, chunk_rows=0)
+    row_bytes = width * ((num_bands - 1) * np.dtype(dtype).itemsize + _PREDICT_ITEMSIZE)
+    chunk_rows = int((budget - fixed) // row_bytes)
+    if chunk_rows < 1:
+        raise too_large
+    logger.info(f"{height}x{width} window over the memory budget, predicting in tiles of {chunk_rows} rows")
+    return chunk_rows
+
+
+@contextmanager
+def measure_peak_memory():
+    """
+    Yields a dict whose "peak_bytes" is set, on exit, to the peak traced
+    allocation (Python and NumPy) above the level at entry, when
+    REQUEST_MEMORY_TRACE is on.
+
+    tracemalloc is process-wide: it is started by the first active
+    measurement and stopped by the last. The peak is only reset when no
+    other measurement is running, so overlapping requests report an
+    upper bound (their combined peak) rather than a low one.
+    """
+    global _active_traces, _owns_trace
+
+    stats = {"peak_bytes": None}
+    if not REQUEST_MEMORY_TRACE:
+        yield stats
+        return
+
+    with _trace_lock:
+        if _active_traces == 0:
+            _owns_trace = not tracemalloc.is_tracing()
+            if _owns_trace:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        _active_traces += 1
+        baseline, _ = tracemalloc.get_traced_memory()
+    try:
+        yield stats
+    finally:
+        with _trace_lock:
+            _, peak = tracemalloc.get_traced_memory()
+            stats["peak_bytes"] = max(peak - baseline, 0)
+            _active_traces -= 1
+            if _active_traces == 0 and _owns_trace:
+                tracemalloc.stop()
@@ -4,20 +4,22 @@ import logging
 
 logger = logging.getLogger("redis_client")
 
-_redis_client = None
+_redis_clients = {}
 
-def get_redis_client(redis_url: str):
-    global _redis_client
-
-    if _redis_client is None:
+def get_redis_client(redis_url: str, decode_responses: bool = True):
+    """
+    Returns a cached Redis client. Binary payloads (compressed results)
+    need decode_responses=False, which gets its own client.
+    """
+    if decode_responses not in _redis_clients:
         if not redis_url:
             raise RuntimeError("Redis URL was not provided")
 
         logger.info(f"Using Redis URL: {redis_url}")
 
-        _redis_client = redis.StrictRedis.from_url(
+        _redis_clients[decode_responses] = redis.StrictRedis.from_url(
             redis_url,
-            decode_responses=True
+            decode_responses=decode_responses
         )
 
-    return _redis_client
+    return _redis_clients[decode_responses]
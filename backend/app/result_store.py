@@ -0,0 +1,312 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from app.logger import logger
+from app.redis_client import get_redis_client
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+LAYERS = ("lst", "uhi", "counterfactual_uhi", "delta_uhi")
+
+RESULT_TTL_SECONDS = int(os.getenv("RESULT_TTL_SECONDS", 1800))
+RESULT_SPILL_DIR = os.getenv("RESULT_SPILL_DIR", "/tmp/urbanhcf_results")
+RESULT_SPILL_TTL_SECONDS = int(os.getenv("RESULT_SPILL_TTL_SECONDS", 86400))
+# Size cap of the disk tier (least recently used runs go first), 0 disables it.
+RESULT_SPILL_MAX_BYTES = int(os.getenv("RESULT_SPILL_MAX_BYTES", 2 * 1024**3))
+# The disk tier is scanned at most this often, or sooner when writes may exceed the cap.
+RESULT_SPILL_PRUNE_SECONDS = int(os.getenv("RESULT_SPILL_PRUNE_SECONDS", 60))
+RESULT_ENCODING = os.getenv("RESULT_ENCODING", "float32")  # "float32" | "int16"
+
+INT16_NODATA = -32768
+_HEADER_LEN = struct.Struct("<I")
+
+
+def _compress(raw: bytes):
+    if zstd is not None:
+        return "zstd", zstd.ZstdCompressor(level=3).compress(raw)
+    return "zlib", zlib.compress(raw, 6)
+
+
+def _decompress(codec: str, blob: bytes) -> bytes:
+    if codec == "zstd":
+        if zstd is None:
+            raise RuntimeError("zstandard is required to read this result")
+        return zstd.ZstdDecompressor().decompress(blob)
+    return zlib.decompress(blob)
+
+
+def quantize_int16(arr):
+    """
+    Linear int16 quantization over the finite range of `arr`.
+    Returns (int16 array, scale, offset); NaN maps to INT16_NODATA.
+    """
+    arr = np.asarray(arr, dtype=np.float32)
+    finite = arr[np.isfinite(arr)]
+    offset = float(finite.min()) if finite.size else 0.0
+    span = float(finite.max()) - offset if finite.size else 0.0
+    scale = span / 65534.0 if span > 0 else 1.0
+    with np.errstate(invalid="ignore"):
+        quantized = np.round((arr - offset) / scale) - 32767
+    quantized = np.where(np.isfinite(arr), quantized, INT16_NODATA).astype(np.int16)
+    return quantized, scale, offset
+
+
+def dequantize_int16(quantized, scale, offset):
+    arr = (quantized.astype(np.float32) + 32767) * scale + offset
+    arr[quantized == INT16_NODATA] = np.nan
+    return arr
+
+
+def encode_layer(arr, encoding=RESULT_ENCODING):
+    """
+    Encodes one 2D layer as compressed float32 or as int16 with
+    scale/offset quantization (NaN is stored as INT16_NODATA).
+    """
+    arr = np.asarray(arr, dtype=np.float32)
+    header = {"shape": list(arr.shape), "encoding": encoding}
+
+    if encoding == "int16":
+        quantized, scale, offset = quantize_int16(arr)
+        header.update({"scale": scale, "offset": offset})
+        raw = quantized.tobytes()
+    elif encoding == "float32":
+        raw = arr.tobytes()
+    else:
+        raise ValueError(f"Unsupported result encoding: {encoding}")
+
+    header["codec"], blob = _compress(raw)
+    header["raw_nbytes"] = len(raw)
+    header["nbytes"] = len(blob)
+    return header, blob
+
+
+def decode_layer(header: dict, blob: bytes) -> np.ndarray:
+    raw = _decompress(header["codec"], blob)
+    if header["encoding"] == "int16":
+        quantized = np.frombuffer(raw, dtype=np.int16).reshape(header["shape"])
+        return dequantize_int16(quantized, header["scale"], header["offset"])
+    return np.frombuffer(raw, dtype=np.float32).reshape(header["shape"])
+
+
+def encode_result(payload: dict, encoding=RESULT_ENCODING) -> bytes:
+    """
+    Packs a result payload into one blob:
+    <uint32 header length><JSON header><compressed layer blobs...>
+    """
+    header = {"bbox": payload.get("bbox"), "meta": payload.get("meta", {}), "layers": {}}
+    blobs = []
+    for name in LAYERS:
+        if payload.get(name) is None:
+            continue
+        header["layers"][name], blob = encode_layer(payload[name], encoding)
+        blobs.append(blob)
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    return _HEADER_LEN.pack(len(header_bytes)) + header_bytes + b"".join(blobs)
+
+
+def decode_header(blob: bytes):
+    (header_len,) = _HEADER_LEN.unpack_from(blob)
+    start = _HEADER_LEN.size
+    header = json.loads(blob[start:start + header_len].decode("utf-8"))
+    return header, start + header_len
+
+
+def decode_result(blob: bytes) -> dict:
+    header, pos = decode_header(blob)
+    result = {name: None for name in LAYERS}
+    for name, layer_header in header["layers"].items():
+        end = pos + layer_header["nbytes"]
+        result[name] = decode_layer(layer_header, blob[pos:end])
+        pos = end
+    result["bbox"] = header["bbox"]
+    result["meta"] = header["meta"]
+    return result
+
+
+class ResultStore:
+    """
+    Two-tier store for analysis results.
+
+    Redis holds compressed results with a sliding TTL (reads refresh it).
+    Every result is also written through to a local disk tier, so runs
+    that Redis has evicted or expired can still be served. The disk tier
+    has its own TTL and byte cap (reads refresh a run's mtime), enforced
+    by a periodic scan rather than on every write.
+    """
+
+    def __init__(self, redis_url, ttl=RESULT_TTL_SECONDS, spill_dir=RESULT_SPILL_DIR,
+                 spill_ttl=RESULT_SPILL_TTL_SECONDS, encoding=RESULT_ENCODING,
+                 spill_max_bytes=RESULT_SPILL_MAX_BYTES, prune_interval=RESULT_SPILL_PRUNE_SECONDS):
+        self.redis_url = redis_url
+        self.ttl = ttl
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.spill_ttl = spill_ttl
+        self.spill_max_bytes = spill_max_bytes
+        self.prune_interval = prune_interval
+        self.encoding = encoding
+        self._prune_lock = threading.Lock()
+        self._last_prune = float("-inf")
+        # disk tier size at the last scan plus what this process wrote since
+        self._spill_bytes = 0
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def redis(self):
+        return get_redis_client(self.redis_url, decode_responses=False)
+
+    def _key(self, run_id):
+        return f"uhi:{run_id}"
+
+    def _spill_path(self, run_id):
+        return self.spill_dir / f"{run_id}.uhi"
+
+    def put(self, run_id: str, payload: dict) -> dict:
+        blob = encode_result(payload, self.encoding)
+        header, _ = decode_header(blob)
+        stats = {
+            "run_id": run_id,
+            "encoding": self.encoding,
+            "raw_bytes": sum(h["raw_nbytes"] for h in header["layers"].values()),
+            "stored_bytes": len(blob),
+            "layers": {name: h["nbytes"] for name, h in header["layers"].items()},
+        }
+
+        try:
+            pipe = self.redis.pipeline()
+            pipe.setex(self._key(run_id), self.ttl, blob)
+            pipe.setex(f"{self._key(run_id)}:stats", self.ttl, json.dumps(stats))
+            pipe.hincrby("uhi:metrics", "runs", 1)
+            pipe.hincrby("uhi:metrics", "raw_bytes", stats["raw_bytes"])
+            pipe.hincrby("uhi:metrics", "stored_bytes", stats["stored_bytes"])
+            pipe.execute()
+        except Exception as e:
+            if self.spill_dir is None:
+                raise
+            logger.warning(f"redis write failed for {run_id}, disk tier only: {e}")
+
+        if self.spill_dir is not None:
+            self._spill(run_id, blob, stats)
+
+        logger.info(f"stored run {run_id}: {stats['raw_bytes']} -> {stats['stored_bytes']} bytes ({self.encoding})")
+        return stats
+
+    def _spill(self, run_id, blob, stats):
+        path = self._spill_path(run_id)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(blob)
+        os.replace(tmp, path)
+        path.with_suffix(".json").write_text(json.dumps(stats))
+
+        with self._prune_lock:
+            self._spill_bytes += len(blob)
+            due = time.monotonic() - self._last_prune >= self.prune_interval
+            over = self.spill_max_bytes and self._spill_bytes > self.spill_max_bytes
+        if due or over:
+            self.prune_spill()
+
+    def prune_spill(self):
+        """Drops spilled runs past the disk TTL, then the least recently used ones over the byte cap."""
+        cutoff = time.time() - self.spill_ttl
+        runs = []
+        for entry in os.scandir(self.spill_dir):
+            if not entry.name.endswith(".uhi"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            runs.append((stat.st_mtime, stat.st_size, Path(entry.path)))
+
+        runs.sort()
+        total = sum(size for _, size, _ in runs)
+        for mtime, size, path in runs[:-1]:  # never the newest run
+            if mtime >= cutoff and (not self.spill_max_bytes or total <= self.spill_max_bytes):
+                break
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+            total -= size
+
+        with self._prune_lock:
+            self._spill_bytes = total
+            self._last_prune = time.monotonic()
+
+    def get_blob(self, run_id: str):
+        key = self._key(run_id)
+        try:
+            blob = self.redis.get(key)
+        except Exception as e:
+            logger.warning(f"redis read failed for {run_id}: {e}")
+            blob = None
+
+        if blob is not None:
+            self.redis.expire(key, self.ttl)
+            self.redis.expire(f"{key}:stats", self.ttl)
+            return blob
+
+        if self.spill_dir is None:
+            return None
+        path = self._spill_path(run_id)
+        if not path.exists():
+            return None
+
+        try:
+            blob = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        try:
+            self.redis.setex(key, self.ttl, blob)
+        except Exception:
+            pass
+        return blob
+
+    def get(self, run_id: str):
+        blob = self.get_blob(run_id)
+        if blob is None:
+            return None
+        return decode_result(blob)
+
+    def meta(self, run_id: str):
+        """Run metadata (inputs of the analysis) without decoding layers."""
+        blob = self.get_blob(run_id)
+        if blob is None:
+            return None
+        header, _ = decode_header(blob)
+        return header["meta"]
+
+    def stats(self, run_id: str):
+        try:
+            stats = self.redis.get(f"{self._key(run_id)}:stats")
+        except Exception:
+            stats = None
+        if stats is None and self.spill_dir is not None:
+            path = self._spill_path(run_id).with_suffix(".json")
+            stats = path.read_text() if path.exists() else None
+        return json.loads(stats) if stats is not None else None
+
+    def metrics(self):
+        totals = self.redis.hgetall("uhi:metrics")
+        return {k.decode(): int(v) for k, v in totals.items()}
+
+
+_result_store = None
+
+def get_result_store(redis_url: str) -> ResultStore:
+    global _result_store
+
+    if _result_store is None:
+        _result_store = ResultStore(redis_url)
+
+    return _result_store
@@ -0,0 +1,142 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+import rasterio
+
+from app.logger import logger
+
+SHARED_STATE_ENABLED = os.getenv("SHARED_STATE", "1") == "1"
+SHARED_STATE_DIR = os.getenv(
+    "SHARED_STATE_DIR",
+    "/dev/shm/urbanhcf" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "urbanhcf_shared"),
+)
+
+
+@contextmanager
+def file_lock(lock_path):
+    """Exclusive flock on `lock_path`, held across processes for the block."""
+    with open(lock_path, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def file_signature(path) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class SharedArrayStore:
+    """
+    Read-only arrays shared across worker processes as .npy files in a
+    shared directory (tmpfs by default), attached with np.load(mmap_mode="r").
+
+    The first process to need an array publishes it under an exclusive
+    file lock; every other process maps the same pages, so adding workers
+    does not duplicate the data. Entries are keyed by a signature of
+    their source and republished when it changes.
+    """
+
+    def __init__(self, root=SHARED_STATE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._attached = {}
+
+    def _path(self, name):
+        return os.path.join(self.root, f"{name}.npy")
+
+    def _meta_path(self, name):
+        return os.path.join(self.root, f"{name}.json")
+
+    def _lock(self):
+        return file_lock(os.path.join(self.root, ".lock"))
+
+    def _read_meta(self, name):
+        try:
+            with open(self._meta_path(name)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def get(self, name, signature, producer):
+        """
+        Returns (read-only memmap, meta) for `name`, publishing it first if
+        missing or stale. `producer(out_path)` must write the .npy file
+        (e.g. via np.lib.format.open_memmap) and return a JSON-able meta dict.
+        """
+        attached = self._attached.get(name)
+        if attached is not None and attached[2] == signature:
+            return attached[0], attached[1]
+
+        meta = self._read_meta(name)
+        if meta is None or meta.get("signature") != signature:
+            with self._lock():
+                meta = self._read_meta(name)
+                if meta is None or meta.get("signature") != signature:
+                    meta = self._publish(name, signature, producer)
+
+        array = np.load(self._path(name), mmap_mode="r")
+        self._attached[name] = (array, meta, signature)
+        return array, meta
+
+    def _publish(self, name, signature, producer):
+        tmp = f"{self._path(name)}.{os.getpid()}.tmp.npy"
+        meta = dict(producer(tmp) or {})
+        meta["signature"] = signature
+        os.replace(tmp, self._path(name))
+        with open(self._meta_path(name), "w") as f:
+            json.dump(meta, f)
+        logger.info(f"published shared array {name} ({os.path.getsize(self._path(name))} bytes)")
+        return meta
+
+
+_shared_store = None
+
+def get_shared_store():
+    """Per-process handle to the shared store, or None when disabled."""
+    global _shared_store
+
+    if not SHARED_STATE_ENABLED:
+        return None
+    if _shared_store is None:
+        _shared_store = SharedArrayStore()
+    return _shared_store
+
+
+def shared_raster(path, band=None):
+    """
+    Full-extent raster as a shared read-only memmap: (F, H, W), or (H, W)
+    when `band` is given. Returns (array, meta with "transform" and "crs"),
+    or None for remote paths or when shared state is disabled.
+    """
+    store = get_shared_store()
+    if store is None or not os.path.exists(path):
+        return None
+
+    def producer(out_path):
+        with rasterio.open(path) as src:
+            bands = [band] if band else list(src.indexes)
+            shape = (src.height, src.width) if band else (src.count, src.height, src.width)
+            out = np.lib.format.open_memmap(out_path, mode="w+", dtype=src.dtypes[bands[0] - 1], shape=shape)
+            for i, idx in enumerate(bands):
+                if band:
+                    out[:] = src.read(idx)
+                else:
+                    out[i] = src.read(idx)
+            out.flush()
+            return {
+                "transform": list(src.transform)[:6],
+                "crs": src.crs.to_string() if src.crs else None,
+                "descriptions": list(src.descriptions),
+            }
+
+    digest = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:8]
+    name = f"{os.path.splitext(os.path.basename(path))[0]}_{digest}" + (f"_b{band}" if band else "")
+    return store.get(name, file_signature(path), producer)
@@ -1,64 +1,241 @@
 import numpy as np
 import rasterio
 
-def apply_counterfactuals(data:np.ndarray, feature_name: str, change_value: dict) -> np.ndarray:
+FEATURE_MAP = {
+    'NDVI': 0,
+    'EVI': 1,
+    'sph': 2,
+    'pr': 3,
+    'impervious_descriptor': 4,
+    'landcover': 5,
+    'forecast_albedo': 6,
+    'built_height': 7,
+    'elevation': 8,
+    'LST_1KM': 9
+}
+
+# Physically meaningful (min, max) per feature, None means unbounded.
+# Used by the "clip" operation when no explicit bounds are given.
+PHYSICAL_RANGES = {
+    'NDVI': (-1.0, 1.0),
+    'EVI': (-1.0, 1.0),
+    'sph': (0.0, None),
+    'pr': (0.0, None),
+    'impervious_descriptor': (0.0, None),
+    'forecast_albedo': (0.0, 1.0),
+    'built_height': (0.0, None),
+}
+
+CF_OPERATIONS = ("add", "set", "multiply", "scale", "divide", "clip")
+
+
+class CounterfactualCube:
     """
-    Apply counterfactual change to a feature slice in a 3D feature tensor.
+    Lazy (F, H, W) feature cube: a base array plus per-band overrides.
+
+    Unchanged bands are returned as views of the base array, so a scenario
+    only costs memory for the bands it actually modifies.
+    """
+
+    def __init__(self, base: np.ndarray, overrides: dict = None):
+        if isinstance(base, CounterfactualCube):
+            merged = dict(base.overrides)
+            merged.update(overrides or {})
+            base, overrides = base.base, merged
+        self.base = base
+        self.overrides = dict(overrides or {})
+
+    @property
+    def shape(self):
+        return self.base.shape
+
+    @property
+    def ndim(self):
+        return self.base.ndim
+
+    @property
+    def dtype(self):
+        return self.base.dtype
+
+    @property
+    def changed_bands(self):
+        return sorted(self.overrides)
+
+    @property
+    def override_nbytes(self):
+        return sum(band.nbytes for band in self.overrides.values())
+
+    def band(self, idx: int) -> np.ndarray:
+        if idx < 0:
+            idx += self.shape[0]
+        if idx in self.overrides:
+            return self.overrides[idx]
+        return self.base[idx]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        """
+        Band-wise indexing: `cube[i]`, `cube[i, rows, cols]`, and a slice
+        or list of bands first (`cube[:-1, :, :]`), which stacks only the
+        selected part of each band. Other keys raise TypeError; use
+        np.asarray(cube) for a full copy.
+        """
+        if isinstance(key, (int, np.integer)):
+            return self.band(int(key))
+        if not isinstance(key, tuple):
+            key = (key,)
+        if not key or key[0] is Ellipsis:
+            raise TypeError(f"CounterfactualCube keys must select bands first, got {key!r}")
+
+        bands, rest = key[0], key[1:]
+        if isinstance(bands, (int, np.integer)):
+            return self.band(int(bands))[rest]
+        if isinstance(bands, slice):
+            indices = np.arange(len(self))[bands]
+        else:
+            indices = np.asarray(bands)
+            if indices.ndim != 1 or (indices.size and indices.dtype.kind not in "iu"):
+                raise TypeError(f"CounterfactualCube band index must be an int, slice or int list, got {bands!r}")
+        if not indices.size:
+            return self.base[(indices.astype(np.intp),) + rest]
+        return np.stack([self.band(int(idx))[rest] for idx in indices])
+
+    def __array__(self, dtype=None, copy=None):
+        out = np.array(self.base, dtype=dtype, copy=True)
+        for idx, band in self.overrides.items():
+            out[idx] = band
+        return out
+
+
+def _resolve_feature(feature_name: str) -> int:
+    if feature_name not in FEATURE_MAP:
+        raise ValueError(f"Feature '{feature_name}' not found in feature_map")
+    return FEATURE_MAP[feature_name]
+
+
+def _apply_operation(band: np.ndarray, feature_name: str, change: dict) -> np.ndarray:
+    cf_type = change["type"]
+
+    if cf_type == "clip":
+        lo, hi = PHYSICAL_RANGES.get(feature_name, (None, None))
+        lo = change.get("min", lo)
+        hi = change.get("max", hi)
+        if lo is None and hi is None:
+            return band
+        return np.clip(band, lo, hi)
+
+    if "value" not in change:
+        raise ValueError("change_value must contain 'type' and 'value'")
+    value = change["value"]
+
+    if cf_type == "add":
+        return band + value
+    if cf_type == "set":
+        return np.full_like(band, value)
+    if cf_type in ("multiply", "scale"):
+        return band * value
+    if cf_type == "divide":
+        return band / value
+
+    raise ValueError(f"Unsupported counterfactual type: {cf_type}")
+
+
+def normalize_counterfactual_spec(feature_name=None, change_value=None, changes=None) -> list:
+    """
+    Builds an ordered list of {"feature", "type", ...} changes from either
+    the legacy (feature_name, change_value) pair or an explicit list.
+    """
+    spec = []
+    if feature_name not in (None, "none") and change_value is not None:
+        spec.append({"feature": feature_name, **change_value})
+    for change in changes or []:
+        spec.append(dict(change))
+
+    for change in spec:
+        if "feature" not in change or "type" not in change:
+            raise ValueError("each change must contain 'feature' and 'type'")
+        _resolve_feature(change["feature"])
+        if change["type"] not in CF_OPERATIONS:
+            raise ValueError(f"Unsupported counterfactual type: {change['type']}")
+    return spec
+
+
+def apply_counterfactual_spec(data, spec: list, dtype=None) -> CounterfactualCube:
+    """
+    Apply a list of changes to a (F, H, W) feature cube.
+
+    Changes are applied in order, so several operations on the same feature
+    compose (e.g. scale then clip). The input is never modified.
 
     Args:
-        data: np.ndarray of shape (F, H, W)
-        feature_map: dict mapping feature_name -> index
-        feature_name: feature to modify
-        change_value: {
-            "type": "divide" | "multiply",
-            "value": float
-        }
+        data: np.ndarray or CounterfactualCube of shape (F, H, W)
+        spec: [{"feature": "EVI", "type": "add" | "set" | "multiply" |
+                "scale" | "divide" | "clip", "value": float,
+                "min": float, "max": float}, ...]
+        dtype: optional dtype for the modified bands (default: as computed)
 
     Returns:
-        New np.ndarray with counterfactual applied
+        CounterfactualCube holding only the modified bands
     """
-    feature_map = {
-            'NDVI': 0,
-            'EVI': 1,
-            'sph': 2,
-            'pr': 3,
-            'impervious_descriptor': 4,
-            'landcover': 5,
-            'forecast_albedo': 6,
-            'built_height': 7,
-            'elevation': 8,
-            'LST_1KM': 9
-        }
-
     if data.ndim != 3:
         raise ValueError("data must be a 3D array (F, H, W)")
 
-    if feature_name not in feature_map:
-        raise ValueError(f"Feature '{feature_name}' not found in feature_map")
+    cube = CounterfactualCube(data)
+    overrides = dict(cube.overrides)
+    for change in spec:
+        feature_idx = _resolve_feature(change["feature"])
+        band = overrides.get(feature_idx, cube.base[feature_idx])
+        band = _apply_operation(band, change["feature"], change)
+        overrides[feature_idx] = band if dtype is None else band.astype(dtype, copy=False)
 
-    if "type" not in change_value or "value" not in change_value:
-        raise ValueError("change_value must contain 'type' and 'value'")
-       
-    cf_type = change_value["type"]
-    value = change_value["value"]
-    feature_idx = feature_map[feature_name]
+    return CounterfactualCube(cube.base, overrides)
 
-    # Copy to avoid in-place modification
-    new_data = data.copy()
 
-    feature_slice = new_data[feature_idx, :, :]
+def apply_counterfactuals(data, feature_name: str = None, change_value: dict = None, changes: list = None,
+                          dtype=None) -> CounterfactualCube:
+    """
+    Apply counterfactual change to a feature slice in a 3D feature tensor.
 
+    Args:
+        data: np.ndarray of shape (F, H, W)
+        feature_name: feature to modify
+        change_value: {
+            "type": "add" | "set" | "multiply" | "scale" | "divide" | "clip",
+            "value": float
+        }
+        changes: optional list of further changes, see apply_counterfactual_spec
+        dtype: optional dtype for the modified bands
 
-    if cf_type == "divide":
-        new_data[feature_idx, :, :] = feature_slice / value
+    Returns:
+        CounterfactualCube with counterfactual applied
+    """
+    if change_value is not None and "type" not in change_value:
+        raise ValueError("change_value must contain 'type' and 'value'")
 
-    elif cf_type == "multiply":
-        new_data[feature_idx, :, :] = feature_slice * value
+    spec = normalize_counterfactual_spec(feature_name, change_value, changes)
+    return apply_counterfactual_spec(data, spec, dtype)
 
-    else:
-        raise ValueError(f"Unsupported counterfactual type: {cf_type}")
 
-    return new_data
+def to_pixel_matrix(data, band_indices=None, dtype=np.float64, rows=None) -> np.ndarray:
+    """
+    Builds the (H*W, F) C-contiguous pixel-major matrix the model expects,
+    reading each band once from either an ndarray or a CounterfactualCube.
+    `rows` limits it to a slice of image rows (one prediction tile).
+    """
+    num_bands, H, W = data.shape
+    if band_indices is None:
+        band_indices = range(num_bands)
+    band_indices = list(band_indices)
+    rows = rows or slice(0, H)
+    n_rows = len(range(*rows.indices(H)))
+
+    X = np.empty((n_rows * W, len(band_indices)), dtype=dtype)
+    grid = X.reshape(n_rows, W, len(band_indices))  # view, filled without temporaries
+    for col, idx in enumerate(band_indices):
+        grid[:, :, col] = data[idx][rows]
+    return X
 
 # if __name__ == "__main__":
 #     # Example usage
@@ -69,4 +246,4 @@ def apply_counterfactuals(data:np.ndarray, feature_name: str, change_value: dict
 #     change = {"type": "add", "value": 0.1}
 #     new_data = apply_counterfactuals(data, "NDVI", change)
 #     print("Original NDVI mean:", np.nanmean(data[0]))
-#     print("Counterfactual NDVI mean:", np.nanmean(new_data[0]))
\ No newline at end of file
+#     print("Counterfactual NDVI mean:", np.nanmean(new_data[0]))
@@ -0,0 +1,158 @@
+import argparse
+import logging
+from functools import lru_cache
+
+import lightgbm as lgb
+import numpy as np
+import rasterio
+from affine import Affine
+
+from mcp_agent.agents.counterfactual import FEATURE_MAP, to_pixel_matrix
+from mcp_agent.agents.uhi import urban_reference
+from mcp_agent.server.windows import RasterGrid
+
+logger = logging.getLogger("urbanhcf.partial_dependence")
+
+EDITABLE_FEATURES = ["EVI", "impervious_descriptor", "forecast_albedo", "built_height", "pr", "sph"]
+DEFAULT_FACTORS = [0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.1, 1.2, 1.3, 1.4, 1.5, 1.75, 2.0]
+
+MODEL_PATH = "models/lst_model_500m.txt"
+FEATURES_PATH = "data/feature_data_500m.tif"
+URBAN_MASK_PATH = "data/Rural_mask_500m.tif"
+PD_TABLE_PATH = "models/pd_tables_500m.npz"
+
+
+def build_pd_tables(model_path=MODEL_PATH, features_path=FEATURES_PATH, mask_path=URBAN_MASK_PATH,
+                    out_path=PD_TABLE_PATH, features=EDITABLE_FEATURES, factors=DEFAULT_FACTORS):
+    """
+    Offline step: evaluates the model's per-pixel LST response to scaling
+    each editable feature by every factor in `factors`, over the full raster.
+
+    Saves an npz holding the baseline LST, the urban mask and a
+    (features, factors, H, W) float32 table of LST deltas.
+    """
+    model = lgb.Booster(model_file=model_path)
+    with rasterio.open(features_path) as src:
+        data = src.read()
+        transform = src.transform
+        crs = src.crs.to_string()
+    with rasterio.open(mask_path) as src:
+        mask = src.read(1)
+
+    num_bands, H, W = data.shape
+    X = to_pixel_matrix(data, range(num_bands - 1))
+    base = model.predict(X)
+
+    factors = np.asarray(sorted(factors), dtype=np.float32)
+    deltas = np.empty((len(features), len(factors), H, W), dtype=np.float32)
+    for fi, feature in enumerate(features):
+        col = FEATURE_MAP[feature]
+        original = X[:, col].copy()
+        for ki, factor in enumerate(factors):
+            X[:, col] = original * factor
+            deltas[fi, ki] = (model.predict(X) - base).reshape(H, W)
+        X[:, col] = original
+        logger.info(f"partial dependence done for {feature}")
+
+    np.savez_compressed(
+        out_path,
+        features=np.asarray(features),
+        factors=factors,
+        deltas=deltas,
+        lst=base.reshape(H, W).astype(np.float32),
+        urban_mask=mask,
+        transform=np.asarray(transform)[:6],
+        crs=np.asarray(crs),
+    )
+    logger.info(f"saved partial dependence tables to {out_path}")
+    return out_path
+
+
+class PDTables:
+    """Loaded partial-dependence tables with window lookups."""
+
+    def __init__(self, path=PD_TABLE_PATH):
+        with np.load(path) as npz:
+            self.features = [str(f) for f in npz["features"]]
+            self.factors = npz["factors"]
+            self.deltas = npz["deltas"]
+            self.lst = npz["lst"]
+            self.urban_mask = npz["urban_mask"]
+            self.transform = Affine(*npz["transform"])
+            self.crs = str(npz["crs"])
+        self.raster_grid = RasterGrid(self.transform, self.crs, self.lst.shape)
+
+    def window(self, bbox):
+        """(row slice, col slice) of a [min_lon, min_lat, max_lon, max_lat] bbox, as the window resolver maps it."""
+        return self.raster_grid.slices_of_bounds(*bbox)
+
+    def interpolate(self, feature_name, factor, rows, cols):
+        """Linear interpolation of the per-pixel LST delta at `factor`."""
+        fi = self.features.index(feature_name)
+        curves = self.deltas[fi, :, rows, cols]
+        k = int(np.clip(np.searchsorted(self.factors, factor), 1, len(self.factors) - 1))
+        f0, f1 = self.factors[k - 1], self.factors[k]
+        t = float(np.clip((factor - f0) / (f1 - f0), 0.0, 1.0))
+        return (1.0 - t) * curves[k - 1] + t * curves[k]
+
+
+@lru_cache(maxsize=1)
+def load_pd_tables(path=PD_TABLE_PATH) -> PDTables:
+    return PDTables(path)
+
+
+def change_to_factor(change_value: dict) -> float:
+    cf_type = change_value.get("type")
+    if cf_type in ("multiply", "scale"):
+        return float(change_value["value"])
+    if cf_type == "divide":
+        return 1.0 / float(change_value["value"])
+    raise ValueError(f"Counterfactual type '{cf_type}' needs exact inference")
+
+
+def estimate_delta_uhi(bbox, changes: list, tables: PDTables = None) -> dict:
+    """
+    Approximate ΔUHI for a bbox from the precomputed tables.
+
+    Per-feature LST deltas are interpolated and summed, then UHI is
+    recomputed against the window's urban reference as in compute_uhi.
+    """
+    tables = tables or load_pd_tables()
+    rows, cols = tables.window(bbox)
+    lst_base = tables.lst[rows, cols]
+    urban_mask = tables.urban_mask[rows, cols]
+
+    lst_cf = lst_base.astype(np.float64)
+    extrapolated = False
+    for change in changes:
+        if change["feature"] not in tables.features:
+            raise ValueError(f"No partial dependence table for '{change['feature']}'")
+        factor = change_to_factor(change)
+        extrapolated |= not (tables.factors[0] <= factor <= tables.factors[-1])
+        lst_cf += tables.interpolate(change["feature"], factor, rows, cols)
+
+    uhi_base = lst_base - urban_reference(lst_base, urban_mask)
+    uhi_cf = lst_cf - urban_reference(lst_cf, urban_mask)
+    delta_uhi = uhi_cf - uhi_base
+
+    return {
+        "uhi": float(np.nanmean(uhi_base)),
+        "counterfactual_uhi": float(np.nanmean(uhi_cf)),
+        "delta_uhi": float(np.nanmean(delta_uhi)),
+        "delta_lst": float(np.nanmean(lst_cf - lst_base)),
+        "extrapolated": bool(extrapolated),
+        "approximate": True,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build partial dependence tables for what-if estimates")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--features", default=FEATURES_PATH)
+    parser.add_argument("--mask", default=URBAN_MASK_PATH)
+    parser.add_argument("--out", default=PD_TABLE_PATH)
+    parser.add_argument("--factors", type=float, nargs="+", default=DEFAULT_FACTORS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    build_pd_tables(args.model, args.features, args.mask, args.out, factors=args.factors)
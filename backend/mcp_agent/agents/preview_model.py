@@ -0,0 +1,148 @@
+import argparse
+import json
+import logging
+import time
+
+import lightgbm as lgb
+import numpy as np
+import rasterio
+
+from mcp_agent.agents.counterfactual import FEATURE_MAP, to_pixel_matrix
+from mcp_agent.agents.partial_dependence import EDITABLE_FEATURES
+from mcp_agent.agents.uhi import urban_reference
+
+logger = logging.getLogger("urbanhcf.preview_model")
+
+MODEL_PATH = "models/lst_model_500m.txt"
+PREVIEW_MODEL_PATH = "models/lst_model_500m_preview.txt"
+FEATURES_PATH = "data/feature_data_500m.tif"
+URBAN_MASK_PATH = "data/Rural_mask_500m.tif"
+
+# Error budget for the preview tier: p95 absolute LST error (Kelvin)
+# against the full model over every valid pixel of the raster.
+DEFAULT_MAX_P95_ERROR = 0.5
+CANDIDATE_ITERATIONS = [25, 50, 75, 100, 150, 200, 250, 300, 400]
+# what-if used to report delta UHI error: each editable feature scaled by this
+WHAT_IF_FACTOR = 1.2
+
+
+def _error_stats(pred, ref):
+    err = np.abs(pred - ref)
+    return {
+        "mae": float(np.mean(err)),
+        "p95": float(np.percentile(err, 95)),
+        "max": float(np.max(err)),
+    }
+
+
+def _uhi(lst, urban_mask):
+    return lst - urban_reference(lst, urban_mask)
+
+
+def _timed_predict(model, X, num_iteration=None, repeats=3):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        pred = model.predict(X, num_iteration=num_iteration)
+        best = min(best, time.perf_counter() - start)
+    return pred, best
+
+
+def _what_if_deltas(model, X, urban_mask, uhi, num_iteration=None):
+    """Per-pixel delta UHI of every editable feature scaled by WHAT_IF_FACTOR."""
+    deltas = []
+    for feature in EDITABLE_FEATURES:
+        X_cf = X.copy()
+        X_cf[:, FEATURE_MAP[feature]] *= WHAT_IF_FACTOR
+        deltas.append(_uhi(model.predict(X_cf, num_iteration=num_iteration), urban_mask) - uhi)
+    return np.concatenate(deltas)
+
+
+def measure_error_budget(model, X, urban_mask, iterations):
+    """
+    Compares the model truncated to each iteration count against the full
+    model: LST, UHI and what-if delta UHI error (Kelvin) and prediction speedup.
+    """
+    full, full_seconds = _timed_predict(model, X)
+    uhi_full = _uhi(full, urban_mask)
+    delta_full = _what_if_deltas(model, X, urban_mask, uhi_full)
+
+    report = []
+    for n in iterations:
+        pred, seconds = _timed_predict(model, X, num_iteration=n)
+        uhi = _uhi(pred, urban_mask)
+        report.append({
+            "iterations": n,
+            "lst_error": _error_stats(pred, full),
+            "uhi_error": _error_stats(uhi, uhi_full),
+            "delta_uhi_error": _error_stats(_what_if_deltas(model, X, urban_mask, uhi, n), delta_full),
+            "speedup": round(full_seconds / seconds, 2),
+        })
+    return report
+
+
+def build_preview_model(model_path=MODEL_PATH, features_path=FEATURES_PATH, mask_path=URBAN_MASK_PATH,
+                        out_path=PREVIEW_MODEL_PATH, iterations=None, max_p95_error=DEFAULT_MAX_P95_ERROR):
+    """
+    Offline step: derives the preview model by truncating the full
+    ensemble to its first `iterations` trees. Without `iterations`, picks
+    the smallest candidate whose p95 LST error stays within `max_p95_error`.
+
+    Saves the truncated model and a JSON report of the measured error
+    budget next to it.
+    """
+    model = lgb.Booster(model_file=model_path)
+    with rasterio.open(features_path) as src:
+        data = src.read()
+    with rasterio.open(mask_path) as src:
+        mask = src.read(1).ravel()
+
+    X = to_pixel_matrix(data, range(data.shape[0] - 1))
+    valid = np.isfinite(X).all(axis=1)
+    X, mask = X[valid], mask[valid]
+
+    total = model.current_iteration()
+    candidates = [iterations] if iterations else [n for n in CANDIDATE_ITERATIONS if n < total]
+    report = measure_error_budget(model, X, mask, candidates)
+
+    if iterations:
+        chosen = report[0]
+    else:
+        within = [r for r in report if r["lst_error"]["p95"] <= max_p95_error]
+        if not within:
+            raise ValueError(f"No truncation below {total} trees meets p95 error <= {max_p95_error} K")
+        chosen = within[0]
+
+    model.save_model(out_path, num_iteration=chosen["iterations"])
+    summary = {
+        "source_model": model_path,
+        "source_iterations": total,
+        "preview_iterations": chosen["iterations"],
+        "max_p95_error": max_p95_error,
+        "pixels": int(X.shape[0]),
+        "chosen": chosen,
+        "candidates": report,
+    }
+    report_path = out_path.rsplit(".", 1)[0] + ".json"
+    with open(report_path, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    logger.info(
+        f"preview model: {chosen['iterations']}/{total} trees, "
+        f"LST p95 error {chosen['lst_error']['p95']:.3f} K, {chosen['speedup']}x faster -> {out_path}"
+    )
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Derive the reduced preview LST model")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--features", default=FEATURES_PATH)
+    parser.add_argument("--mask", default=URBAN_MASK_PATH)
+    parser.add_argument("--out", default=PREVIEW_MODEL_PATH)
+    parser.add_argument("--iterations", type=int, default=None, help="fixed tree count instead of searching")
+    parser.add_argument("--max-p95-error", type=float, default=DEFAULT_MAX_P95_ERROR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    build_preview_model(args.model, args.features, args.mask, args.out, args.iterations, args.max_p95_error)
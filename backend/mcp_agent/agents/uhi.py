@@ -0,0 +1,17 @@
+import numpy as np
+
+# UHI is LST minus this percentile of the urban pixels' LST
+URBAN_REFERENCE_PERCENTILE = 25
+
+
+def urban_reference(lst, urban_mask) -> float:
+    """
+    Reference LST the UHI is measured against: the 25th percentile of the
+    finite LST of urban pixels (mask == 0), or the mean LST when there are
+    none.
+    """
+    lst = np.asarray(lst)
+    urban = lst[(np.asarray(urban_mask) == 0) & np.isfinite(lst)]
+    if urban.size == 0:
+        return float(np.nanmean(lst))
+    return float(np.percentile(urban, URBAN_REFERENCE_PERCENTILE))
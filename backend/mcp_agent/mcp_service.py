@@ -1,17 +1,31 @@
 import os
+import json
+import logging
 from dotenv import load_dotenv
 from langchain_groq import ChatGroq
 from mcp_use import MCPAgent, MCPClient
+from app.result_store import get_result_store
+from mcp_agent.plan_cache import PlanCache, normalize_query, render_summary
+
+logger = logging.getLogger("urbanhcf.mcp_service")
+
+MCP_SERVER_NAME = "geocode"
 
 class UrbanHCFMCPService:
-    def __init__(self):
+    def __init__(self, llm=None, plan_cache: PlanCache=None, config_file: str="mcp_agent/server/geocode.json"):
+        """
+        :param llm: chat model for the agent; defaults to Groq. Tests can
+            pass a local stand-in (e.g. langchain's FakeListChatModel).
+        :param plan_cache: resolved tool plans reused for repeat query shapes.
+        """
         load_dotenv()
-        os.environ["GROQ_API_KEY"] = os.getenv("GROQ_API_KEY")
-
-        config_file = "mcp_agent/server/geocode.json"
+        if llm is None:
+            os.environ["GROQ_API_KEY"] = os.getenv("GROQ_API_KEY")
+            llm = ChatGroq(model="openai/gpt-oss-120b")
 
         self.client = MCPClient.from_config_file(config_file)
-        self.llm = ChatGroq(model="openai/gpt-oss-120b")
+        self.llm = llm
+        self.plan_cache = plan_cache if plan_cache is not None else PlanCache()
 
         self.agent = MCPAgent(
             llm=self.llm,
@@ -23,7 +37,20 @@ class UrbanHCFMCPService:
     async def run_query(self, query: str, run_id: str, redis_url:str):
         """
         Run a single MCP query (used by FastAPI)
+
+        Template queries ("UHI in X", "UHI in X if <feature> changes by N%")
+        whose shape was already resolved by the agent skip the LLM: the
+        cached plan is run with the new magnitude and the summary is filled
+        from a template.
         """
+        shape = normalize_query(query)
+        plan = self.plan_cache.lookup(shape)
+        if plan is not None:
+            try:
+                return await self._run_cached_plan(plan, shape, run_id, redis_url)
+            except Exception as e:
+                logger.warning(f"cached plan failed, falling back to agent: {e}")
+
         summary_prompt = """You are explaining Urban Heat Island analysis results to a general user.
         Rules:
         - Max 4-5 bullet points
@@ -33,9 +60,41 @@ class UrbanHCFMCPService:
         - Mention counterfactuals only if present
         - you can explain why this happens, or can improve it.
         """
+        calls_before = len(self.agent.tools_used_names)
         response = await self.agent.run(f"{query} [run_id={run_id}] [redis_url={redis_url} [summary prompt={summary_prompt}]]")
+
+        try:
+            meta = get_result_store(redis_url).meta(run_id)
+            tools_used = self.agent.tools_used_names[calls_before:]
+            if self.plan_cache.remember(shape, meta, tools_used):
+                logger.info(f"cached tool plan for {shape.key}")
+        except Exception as e:
+            logger.warning(f"could not cache tool plan: {e}")
         return response
 
+    async def _session(self):
+        sessions = self.client.get_all_active_sessions()
+        if MCP_SERVER_NAME in sessions:
+            return sessions[MCP_SERVER_NAME]
+        return await self.client.create_session(MCP_SERVER_NAME)
+
+    async def _run_cached_plan(self, plan: dict, shape, run_id: str, redis_url: str):
+        """Runs the cached plan on the MCP server the agent uses, without the LLM."""
+        session = await self._session()
+        result = await session.call_tool(shape.intent, {
+            "lat": plan["lat"],
+            "lon": plan["lon"],
+            "run_id": run_id,
+            "redis_url": redis_url,
+            "feature_name": shape.feature or "none",
+            "change_value": shape.change_value,
+            "cf_data": shape.feature is not None,
+        })
+        text = "".join(getattr(block, "text", "") for block in result.content)
+        if result.isError:
+            raise RuntimeError(f"{shape.intent} failed: {text}")
+        return render_summary(shape, json.loads(text))
+
     async def shutdown(self):
         if self.client and self.client.sessions:
             await self.client.close_all_sessions()
@@ -0,0 +1,241 @@
+import math
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+# Keyword -> feature mapping, mirroring the analyze_uhi_effect tool docs.
+FEATURE_INTENTS = {
+    "EVI": ("green cover", "greenery", "vegetation", "plantation", "trees", "tree", "plants", "green"),
+    "impervious_descriptor": ("impervious", "buildings", "concrete", "built-up", "built up", "pavement", "asphalt"),
+    "forecast_albedo": ("albedo", "reflectivity", "reflective", "cool roof", "white roof"),
+    "built_height": ("building height", "taller", "height", "high-rise", "skyscraper"),
+    "pr": ("rainfall", "precipitation", "rain"),
+    "sph": ("humidity", "moisture", "humid"),
+}
+
+FEATURE_PHRASES = {
+    "EVI": "vegetation",
+    "impervious_descriptor": "built-up surfaces",
+    "forecast_albedo": "surface reflectivity",
+    "built_height": "building height",
+    "pr": "rainfall",
+    "sph": "humidity",
+}
+
+FEATURE_EXPLANATIONS = {
+    "EVI": "Plants cool their surroundings through shade and evapotranspiration.",
+    "impervious_descriptor": "Concrete and asphalt absorb heat during the day and release it slowly.",
+    "forecast_albedo": "Brighter surfaces reflect more sunlight instead of absorbing it as heat.",
+    "built_height": "Taller buildings change shading and trap heat between them.",
+    "pr": "Wetter ground loses heat through evaporation.",
+    "sph": "Moist air and soil change how quickly surfaces heat up and cool down.",
+}
+
+_INCREASE = (
+    "increase", "increases", "increased", "increasing", "more", "add", "adds", "added", "adding",
+    "plant", "planted", "planting", "raise", "raises", "raised", "raising", "boost", "boosts", "boosted",
+    "higher", "grow", "grows", "grew", "grown", "growing", "rise", "rises", "rose", "risen", "rising",
+    "expand", "expands", "expanded", "gain", "gains", "up",
+)
+_DECREASE = (
+    "decrease", "decreases", "decreased", "decreasing", "reduce", "reduces", "reduced", "reducing",
+    "less", "fewer", "lower", "lowers", "lowered", "remove", "removes", "removed", "cut", "cuts",
+    "drop", "drops", "dropped", "dropping", "decline", "declines", "declined", "declining",
+    "fall", "falls", "fell", "fallen", "falling", "shrink", "shrinks", "shrank", "shrunk",
+    "lose", "loses", "lost", "down",
+)
+
+# Question templates served from the cache, all planned as one
+# analyze_uhi_effect call: "UHI in <Place>" and "UHI in <Place> if <change>".
+# Anything else (rankings, comparisons, addresses, times) goes to the agent.
+ANALYZE_TOOL = "analyze_uhi_effect"
+_TEMPLATE_RE = re.compile(
+    r"^(?P<prefix>(?i:(?:what(?:'s| is) )?(?:the )?(?:uhi|urban heat island)(?: effect| intensity)?|what happens))"
+    r" (?i:in|for|around|near|at) (?P<location>[A-Z][\w.'-]*(?:,? [A-Z][\w.'-]*)*)"
+    r"(?:,? (?i:if) (?P<change>[^?]+?))?[?.]?$"
+)
+_PERCENT_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(?:%|percent)")
+_WORD_RE = re.compile(r"[a-z]+")
+
+
+@dataclass(frozen=True)
+class QueryShape:
+    """
+    Normalized query: the tool its template is planned as (`intent`,
+    None when the query matches no template), where, which feature and
+    how much. `ambiguous` marks template queries the normalizer could not
+    read with certainty (several features or magnitudes, no or
+    conflicting direction). Only shapes with an intent that are not
+    ambiguous are served from or stored in the cache.
+    """
+    location: Optional[str]
+    feature: Optional[str]
+    change_value: Optional[dict]
+    ambiguous: bool = False
+    intent: Optional[str] = None
+
+    @property
+    def key(self):
+        return (self.intent, self.location, self.feature)
+
+    @property
+    def cacheable(self):
+        if self.intent is None or self.location is None or self.ambiguous:
+            return False
+        return self.feature is None or self.change_value is not None
+
+    @property
+    def changes(self):
+        """The counterfactual list this shape stands for, as stored in run meta."""
+        return [{"feature": self.feature, **self.change_value}] if self.feature else []
+
+
+def _find_features(text):
+    """Every feature with a keyword in the text."""
+    return {
+        feature
+        for feature, keywords in FEATURE_INTENTS.items()
+        if any(re.search(rf"\b{re.escape(keyword)}\b", text) for keyword in keywords)
+    }
+
+
+def _find_change(text):
+    """
+    Multiplicative change for the text, or None unless exactly one
+    magnitude and one unambiguous direction are found.
+    """
+    words = set(_WORD_RE.findall(text))
+    increase, decrease = bool(words & set(_INCREASE)), bool(words & set(_DECREASE))
+    percents = _PERCENT_RE.findall(text)
+    doubles = words & {"double", "doubled", "doubling", "twice"}
+    halves = words & {"halve", "halved", "halving", "half"}
+
+    if len(percents) + bool(doubles) + bool(halves) != 1:
+        return None
+    if percents:
+        if increase == decrease:
+            return None
+        pct = float(percents[0]) / 100.0
+        return {"type": "multiply", "value": round(1.0 + pct if increase else 1.0 - pct, 6)}
+    if doubles:
+        return None if decrease else {"type": "multiply", "value": 2.0}
+    # "halve" is a direction by itself, "by half" needs one
+    if increase == decrease:
+        return {"type": "multiply", "value": 0.5} if halves - {"half"} and not increase else None
+    return {"type": "multiply", "value": 1.5 if increase else 0.5}
+
+
+def normalize_query(query: str) -> QueryShape:
+    """
+    Matches a natural language query against the cached question
+    templates and extracts (location, feature intent, magnitude), e.g.
+    "UHI in Anaheim if vegetation is increased by 10%" ->
+    ("anaheim", "EVI", {"type": "multiply", "value": 1.1}). Queries outside
+    the templates have no intent; template queries it cannot read with
+    certainty come back ambiguous. Neither is cacheable.
+    """
+    match = _TEMPLATE_RE.match(" ".join(query.split()))
+    if match is None:
+        return QueryShape(None, None, None)
+
+    location = re.sub(r"\s*,\s*", ", ", match.group("location")).lower()
+    text = (match.group("change") or "").lower()
+    if not text:
+        # "what happens in X" needs the "if" clause
+        return QueryShape(location, None, None, ambiguous=match.group("prefix").lower() == "what happens",
+                          intent=ANALYZE_TOOL)
+
+    features = _find_features(text)
+    if len(features) != 1:
+        # several features, or a change without a known one, are for the agent to interpret
+        return QueryShape(location, None, None, ambiguous=True, intent=ANALYZE_TOOL)
+
+    feature = features.pop()
+    change_value = _find_change(text)
+    return QueryShape(location, feature, change_value, ambiguous=change_value is None, intent=ANALYZE_TOOL)
+
+
+class PlanCache:
+    """
+    Bounded LRU of resolved tool plans keyed by (intent, location, feature).
+
+    A plan is what the agent worked out for a query shape (the
+    coordinates it analyzed); the magnitude is filled in per query.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, shape: QueryShape):
+        if not shape.cacheable:
+            return None
+        with self._lock:
+            plan = self._plans.get(shape.key)
+            if plan is None:
+                self.misses += 1
+                return None
+            self._plans.move_to_end(shape.key)
+            self.hits += 1
+            return plan
+
+    def remember(self, shape: QueryShape, meta: dict, tools_used: list) -> bool:
+        """
+        Stores the plan recorded in a run's result meta, but only when the
+        agent made exactly one call, to the tool the shape is planned as,
+        and its counterfactual (feature, type and value) is exactly the
+        normalized intent.
+        """
+        if not shape.cacheable or meta is None or list(tools_used) != [shape.intent]:
+            return False
+        if not _same_changes(meta.get("changes", []), shape.changes):
+            return False
+
+        with self._lock:
+            self._plans[shape.key] = {"lat": meta["lat"], "lon": meta["lon"]}
+            self._plans.move_to_end(shape.key)
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+        return True
+
+
+def _same_changes(actual: list, expected: list) -> bool:
+    if len(actual) != len(expected):
+        return False
+    for got, want in zip(actual, expected):
+        if set(got) != set(want) or got["feature"] != want["feature"] or got["type"] != want["type"]:
+            return False
+        if not math.isclose(float(got["value"]), float(want["value"]), rel_tol=1e-6):
+            return False
+    return True
+
+
+def render_summary(shape: QueryShape, result: dict) -> str:
+    """Templated plain-English summary for a cached plan's fresh numbers."""
+    stats = result["geojson"]
+    place = shape.location.title()
+    lines = [
+        f"- The average land surface temperature around {place} is about {stats['lst']:.1f} K "
+        f"({stats['lst'] - 273.15:.1f} °C).",
+        f"- Its urban heat island intensity is {stats['uhi']:+.2f} °C compared with the cooler parts of the surrounding city.",
+    ]
+
+    if shape.feature and stats.get("delta_uhi") is not None and stats["delta_uhi"] == stats["delta_uhi"]:
+        factor = shape.change_value["value"]
+        verb = "Increasing" if factor >= 1 else "Reducing"
+        pct = abs(factor - 1) * 100
+        delta = stats["delta_uhi"]
+        effect = "cool" if delta < 0 else "warm"
+        lines.append(
+            f"- {verb} {FEATURE_PHRASES[shape.feature]} by {pct:.0f}% would {effect} the area by about "
+            f"{abs(delta):.2f} °C, bringing UHI to {stats['counterfactual_uhi']:+.2f} °C."
+        )
+        lines.append(f"- {FEATURE_EXPLANATIONS[shape.feature]}")
+    else:
+        lines.append("- Adding vegetation or more reflective surfaces are common ways to lower this.")
+    return "\n".join(lines)
@@ -0,0 +1,240 @@
+import argparse
+import logging
+import os
+from functools import lru_cache
+
+import lightgbm as lgb
+import numpy as np
+import rasterio
+from affine import Affine
+
+from mcp_agent.agents.counterfactual import FEATURE_MAP, to_pixel_matrix
+from mcp_agent.agents.uhi import urban_reference
+from app.shared_state import file_lock, file_signature, get_shared_store, shared_raster
+from mcp_agent.server.windows import RasterGrid
+
+logger = logging.getLogger("urbanhcf.baseline")
+
+MODEL_PATH = "models/lst_model_500m.txt"
+FEATURES_PATH = os.getenv("FEATURE_DATA_PATH", "data/feature_data_500m.tif")
+URBAN_MASK_PATH = os.getenv("URBAN_MASK_PATH", "data/Rural_mask_500m.tif")
+BASELINE_GRID_PATH = os.getenv("BASELINE_GRID_PATH", "data/baseline_grid_500m.npz")
+# largest neighborhood radius (cells) accepted by point queries
+MAX_POINT_RADIUS = 10
+
+
+def build_baseline_grid(model_path=MODEL_PATH, features_path=FEATURES_PATH, mask_path=URBAN_MASK_PATH,
+                        out_path=BASELINE_GRID_PATH, sensitivity=None):
+    """
+    Predicts LST over the full raster extent and derives a baseline UHI
+    grid against the extent-wide urban reference (urban_reference, as in
+    compute_urban_mean_lst).
+
+    sensitivity: optional {feature_name: factor}; for each entry a
+    "sens_<feature>" layer holds the per-pixel UHI change when that
+    feature is scaled by `factor`.
+    """
+    model = lgb.Booster(model_file=model_path)
+    with rasterio.open(features_path) as src:
+        data = src.read()
+        transform = src.transform
+        crs = src.crs.to_string()
+    with rasterio.open(mask_path) as src:
+        urban_mask = src.read(1)
+
+    num_bands, H, W = data.shape
+    X = to_pixel_matrix(data, range(num_bands - 1))
+    lst = model.predict(X).reshape(H, W)
+    reference = urban_reference(lst, urban_mask)
+
+    layers = {
+        "lst": lst.astype(np.float32),
+        "uhi": (lst - reference).astype(np.float32),
+    }
+    for feature, factor in (sensitivity or {}).items():
+        col = FEATURE_MAP[feature]
+        original = X[:, col].copy()
+        X[:, col] = original * factor
+        lst_cf = model.predict(X).reshape(H, W)
+        X[:, col] = original
+        uhi_cf = lst_cf - urban_reference(lst_cf, urban_mask)
+        layers[f"sens_{feature}"] = (uhi_cf - layers["uhi"]).astype(np.float32)
+        logger.info(f"sensitivity layer for {feature} x{factor} done")
+
+    # written aside and renamed, so readers never load a half-written zip
+    tmp = f"{out_path}.{os.getpid()}.tmp.npz"
+    np.savez(
+        tmp,
+        urban_mask=urban_mask,
+        transform=np.asarray(transform)[:6],
+        crs=np.asarray(crs),
+        **layers,
+    )
+    os.replace(tmp, out_path)
+    logger.info(f"saved baseline grid to {out_path}")
+    return out_path
+
+
+def check_point_query(lats, lons, radius):
+    if not 1 <= radius <= MAX_POINT_RADIUS:
+        raise ValueError(f"radius must be between 1 and {MAX_POINT_RADIUS}, got {radius}")
+    if np.size(lats) != np.size(lons):
+        raise ValueError("lats and lons must have the same length")
+
+
+class BaselineGrid:
+    """Full-extent baseline layers plus the raster geometry to index them."""
+
+    def __init__(self, path=BASELINE_GRID_PATH, arrays=None):
+        if arrays is None:
+            with np.load(path) as npz:
+                arrays = {name: npz[name] for name in npz.files}
+        self.transform = Affine(*arrays["transform"])
+        self.crs = str(arrays["crs"])
+        self.urban_mask = arrays["urban_mask"]
+        self.layers = {name: arr for name, arr in arrays.items()
+                       if name in ("lst", "uhi") or name.startswith("sens_")}
+        self.shape = self.layers["lst"].shape
+        # lat/lon <-> pixel mapping shared with the analysis window resolver
+        self.raster_grid = RasterGrid(self.transform, self.crs, self.shape)
+
+    def layer(self, name):
+        if name not in self.layers:
+            raise ValueError(f"Unknown layer '{name}', available: {sorted(self.layers)}")
+        return self.layers[name]
+
+    def _neighborhoods(self, name, rows, cols, radius):
+        """
+        (N, (2*radius+1)^2) values around each (row, col), NaN past the grid
+        edges. Indexes the (possibly shared) layer directly, no padded copy.
+        """
+        offsets = np.arange(-radius, radius + 1)
+        rr = rows[:, None, None] + offsets[None, :, None]
+        cc = cols[:, None, None] + offsets[None, None, :]
+        H, W = self.shape
+        inside = (rr >= 0) & (rr < H) & (cc >= 0) & (cc < W)
+        hood = self.layer(name)[np.clip(rr, 0, H - 1), np.clip(cc, 0, W - 1)].astype(np.float32)
+        return np.where(inside, hood, np.nan).reshape(len(rows), -1)
+
+    def query_points(self, lats, lons, radius=3, layers=("lst", "uhi")) -> dict:
+        """
+        Vectorized point lookup: the pixel value at each lat/lon plus stats
+        over the (2*radius+1)^2 pixel neighborhood around it.
+
+        Returns per-layer arrays (NaN for points outside the grid):
+        value, mean, min, max, delta (value - mean) and percentile
+        (share of neighbors cooler than the point).
+
+        Raises ValueError unless 1 <= radius <= MAX_POINT_RADIUS and
+        lats and lons have the same length.
+        """
+        check_point_query(lats, lons, radius)
+        rows, cols = self.raster_grid.pixel_of(np.atleast_1d(lats), np.atleast_1d(lons))
+        inside = self.raster_grid.in_bounds(rows, cols)
+        r, c = np.where(inside, rows, 0), np.where(inside, cols, 0)
+
+        result = {"in_bounds": inside, "row": rows, "col": cols}
+        for name in layers:
+            value = self.layer(name)[r, c].astype(np.float64)
+            hood = self._neighborhoods(name, r, c, radius)
+            finite = np.isfinite(hood)
+            count = np.maximum(finite.sum(axis=1), 1)
+            with np.errstate(invalid="ignore"):
+                mean = np.where(finite, hood, 0).sum(axis=1) / count
+                stats = {
+                    "value": value,
+                    "mean": mean,
+                    "min": np.where(finite, hood, np.inf).min(axis=1),
+                    "max": np.where(finite, hood, -np.inf).max(axis=1),
+                    "delta": value - mean,
+                    "percentile": 100.0 * (finite & (hood < value[:, None])).sum(axis=1) / count,
+                }
+            for key, arr in stats.items():
+                arr = np.where(inside & finite.any(axis=1), arr, np.nan)
+                stats[key] = arr
+            result[name] = stats
+        return result
+
+
+def point_records(lats, lons, result: dict, layers=("lst", "uhi")) -> list:
+    """Flattens query_points output into one JSON-friendly dict per point."""
+    def clean(v):
+        return float(v) if np.isfinite(v) else None
+
+    records = []
+    for i, (lat, lon) in enumerate(zip(np.atleast_1d(lats), np.atleast_1d(lons))):
+        record = {"lat": float(lat), "lon": float(lon), "in_bounds": bool(result["in_bounds"][i])}
+        for name in layers:
+            record[name] = {key: clean(arr[i]) for key, arr in result[name].items()}
+        records.append(record)
+    return records
+
+
+def _shared_baseline_arrays(path):
+    """Baseline layers as shared read-only memmaps, one per npz member."""
+    store = get_shared_store()
+    if store is None:
+        return None
+
+    with np.load(path) as npz:
+        names = npz.files
+
+    def producer(name):
+        def write(out_path):
+            with np.load(path) as npz:
+                np.save(out_path, npz[name])
+        return write
+
+    signature = file_signature(path)
+    return {name: store.get(f"baseline_{name}", signature, producer(name))[0] for name in names}
+
+
+@lru_cache(maxsize=1)
+def load_baseline_grid(path=BASELINE_GRID_PATH) -> BaselineGrid:
+    """
+    Loads the baseline grid, building it (without sensitivity layers) if
+    missing. One process builds under a file lock while the others wait
+    for it. Layers are attached from shared memory when enabled.
+    """
+    if not os.path.exists(path):
+        with file_lock(f"{path}.lock"):
+            if not os.path.exists(path):
+                logger.info(f"{path} not found, building baseline grid")
+                build_baseline_grid(out_path=path)
+    return BaselineGrid(path, arrays=_shared_baseline_arrays(path))
+
+
+def preload_shared_state():
+    """
+    Startup hook: publishes (or attaches to) the read-only feature cube,
+    urban mask and baseline grid in shared memory so every worker
+    process maps the same pages.
+
+    A missing baseline grid is not built here (that predicts the whole
+    extent); it is built on the first point query instead.
+    """
+    shared_raster(FEATURES_PATH)
+    shared_raster(URBAN_MASK_PATH, band=1)
+    if os.path.exists(BASELINE_GRID_PATH):
+        load_baseline_grid()
+    else:
+        logger.info(f"{BASELINE_GRID_PATH} not found, skipping baseline grid preload")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the full-extent baseline LST/UHI grid")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--features", default=FEATURES_PATH)
+    parser.add_argument("--mask", default=URBAN_MASK_PATH)
+    parser.add_argument("--out", default=BASELINE_GRID_PATH)
+    parser.add_argument("--sensitivity", nargs="*", default=[],
+                        help="feature:factor pairs, e.g. forecast_albedo:1.2 EVI:1.2")
+    args = parser.parse_args()
+
+    sensitivity = {}
+    for item in args.sensitivity:
+        feature, factor = item.split(":")
+        sensitivity[feature] = float(factor)
+
+    logging.basicConfig(level=logging.INFO)
+    build_baseline_grid(args.model, args.features, args.mask, args.out, sensitivity)
@@ -6,19 +6,26 @@ sys.path.append(str(Path(__file__).resolve().parent.parent.parent))
 from typing import Any
 import requests
 import rasterio
-from rasterio.windows import from_bounds
+from rasterio.windows import transform as window_transform
 from mcp.server.fastmcp import FastMCP
-from pyproj import Transformer
-import math
+from functools import lru_cache
 import lightgbm as lgb
-from mcp_agent.agents.counterfactual import apply_counterfactuals
+from mcp_agent.agents.counterfactual import FEATURE_MAP, apply_counterfactuals, normalize_counterfactual_spec, to_pixel_matrix
+from mcp_agent.agents.partial_dependence import PD_TABLE_PATH, estimate_delta_uhi
+from mcp_agent.agents.uhi import urban_reference
+from mcp_agent.server.ranking import get_ranking_index
+from mcp_agent.server.baseline import load_baseline_grid, point_records, preload_shared_state
+from mcp_agent.server.windows import DEFAULT_BUFFER_KM, get_window_resolver
 import numpy as np
 import pandas as pd
 import os
 import json
 import pickle
 import shutil
-from app.redis_client import get_redis_client
+from app.memory_budget import measure_peak_memory, pipeline_dtype, plan_chunk_rows
+from app.result_store import get_result_store
+from app.shared_state import shared_raster
+from utils import open_raster
 
 import logging
 import traceback
@@ -28,29 +35,65 @@ logger.setLevel(logging.DEBUG)
 
 # Initialize FastMCP server
 mcp = FastMCP("geocode")    
-model = lgb.Booster(model_file="models/lst_model_500m.txt")
+LST_MODEL_PATH = os.getenv("LST_MODEL_PATH", "models/lst_model_500m.txt")
+# truncated ensemble built by mcp_agent.agents.preview_model
+LST_PREVIEW_MODEL_PATH = os.getenv("LST_PREVIEW_MODEL_PATH", "models/lst_model_500m_preview.txt")
+QUALITY_LEVELS = ("preview", "full")
+model = lgb.Booster(model_file=LST_MODEL_PATH)
+# local paths or remote http(s):// / gs:// objects (read by byte range)
+FEATURE_DATA_PATH = os.getenv("FEATURE_DATA_PATH", "data/feature_data_500m.tif")
+URBAN_MASK_PATH = os.getenv("URBAN_MASK_PATH", "data/Rural_mask_500m.tif")
+
+
+@lru_cache(maxsize=None)
+def get_lst_model(quality: str="full"):
+    """
+    Booster for a quality tier: "full" is the trained model, "preview" the
+    reduced model for interactive what-ifs (falls back to full if missing).
+    """
+    if quality not in QUALITY_LEVELS:
+        raise ValueError(f"Unknown quality '{quality}', expected one of {QUALITY_LEVELS}")
+    if quality == "preview":
+        if os.path.exists(LST_PREVIEW_MODEL_PATH):
+            return lgb.Booster(model_file=LST_PREVIEW_MODEL_PATH)
+        logger.warning(f"{LST_PREVIEW_MODEL_PATH} not found, previews use the full model")
+    return model
 
 
-def bbox_from_point(lat, lon, buffer_km=3):
+def resolve_windows(lats, lons, buffer_km=DEFAULT_BUFFER_KM) -> list:
+    """
+    Vectorized (window, bbox) pairs around many points, on the grid
+    shared by the feature cube and the urban mask.
+    """
+    return get_window_resolver(FEATURE_DATA_PATH, URBAN_MASK_PATH).windows(lats, lons, buffer_km)
+
+def resolve_window(lat, lon, buffer_km=DEFAULT_BUFFER_KM):
+    return resolve_windows(lat, lon, buffer_km)[0]
 
-    lat_buffer = buffer_km / 111.0
-    lon_buffer = buffer_km / (111.0 * math.cos(math.radians(lat)))
+def check_window(window, lat, lon):
+    if window.height == 0 or window.width == 0:
+        raise ValueError(f"location ({lat}, {lon}) is outside the data extent")
 
-    min_lon = lon - lon_buffer
-    min_lat = lat - lat_buffer
-    max_lon = lon + lon_buffer
-    max_lat = lat + lat_buffer
-    return {
-        "type": "Polygon",
-        "coordinates": [min_lon, min_lat, max_lon, max_lat]
-    }
+def read_raster_window(path, window, band=None):
+    """
+    Reads a pixel window of a raster (all bands, or one `band`), as a
+    zero-copy view of the shared-memory copy when one is available.
+    """
+    shared = shared_raster(path, band)
+    if shared is not None:
+        array, _ = shared
+        rows, cols = window.toslices()
+        return np.asarray(array[..., rows, cols])
+
+    with open_raster(path) as src:
+        return src.read(band, window=window) if band else src.read(window=window)
 
 def load_urban_mask(mask_path):
-    with rasterio.open(mask_path) as src:
+    with open_raster(mask_path) as src:
         mask = src.read(1)
     return mask
 
-def compute_urban_mean_lst(lst_preds, urban_mask_path, bbox):
+def compute_urban_mean_lst(lst_preds, urban_mask_path, window):
     # Ensure numpy arrays
     lst_preds = np.asarray(lst_preds)
 
@@ -58,12 +101,7 @@ def compute_urban_mean_lst(lst_preds, urban_mask_path, bbox):
     if lst_preds.ndim == 3:
         lst_preds = np.squeeze(lst_preds)
 
-    with rasterio.open(urban_mask_path) as src:
-        window = from_bounds(
-            *bbox,
-            transform=src.transform
-        )
-        urban_mask_data = src.read(1, window=window)
+    urban_mask_data = read_raster_window(urban_mask_path, window, band=1)
 
     if lst_preds.shape != urban_mask_data.shape:
         raise ValueError(
@@ -72,14 +110,7 @@ def compute_urban_mean_lst(lst_preds, urban_mask_path, bbox):
             f"urban_mask {urban_mask_data.shape}"
         )
 
-    rural_pixels = urban_mask_data > 0
-    urban_pixels = urban_mask_data==0
-    
-    if rural_pixels.size==0:
-        urban_mean = float(np.nanmean(lst_preds[rural_pixels]))
-    else:
-        urban_mean = np.percentile(lst_preds[urban_pixels], 25),
-    return urban_mean
+    return urban_reference(lst_preds, urban_mask_data)
 
 def prepare_geojson_layer(arr, name="Layer"):
     """
@@ -102,14 +133,14 @@ def prepare_geojson_layer(arr, name="Layer"):
         "name": name
     }
 
-def compute_uhi(lst_preds, urban_mask, bbox):
+def compute_uhi(lst_preds, urban_mask, window, dtype=None):
     """
-    Computes UHI for the bbox region if the urbanmask
+    Computes UHI for the pixel window if the urbanmask
     and lst predictions are given.
     This is called if UHI map is needed.
     """
-    urban_mean = compute_urban_mean_lst(lst_preds, urban_mask, bbox)
-    uhi_map = lst_preds - urban_mean
+    urban_mean = compute_urban_mean_lst(lst_preds, urban_mask, window)
+    uhi_map = np.subtract(lst_preds, urban_mean, dtype=pipeline_dtype(dtype))
     return uhi_map
 
 
@@ -139,76 +170,207 @@ def get_geometry(location: str):
         "admin1": loc.get("admin1")
     }
 
-def bbox_from_latlon(lat: float, lon: float, buffer_km: float = 3) -> Any:
-    
-    return bbox_from_point(lat, lon, buffer_km)
+def read_feature_window(window, dtype=None):
+    """
+    Feature cube for a pixel window plus the per-feature means.
+    In float32 mode the cube is float32 (no copy for float32 rasters).
+    """
+    data = read_raster_window(FEATURE_DATA_PATH, window)
+    if pipeline_dtype(dtype) == np.float32:
+        data = data.astype(np.float32, copy=False)
+    feature_info = {
+    'NDVI': float(np.nanmean(data[0])),
+    'EVI': float(np.nanmean(data[1])),
+    'sph': float(np.nanmean(data[2])),
+    'pr': float(np.nanmean(data[3])),
+    'impervious_descriptor': float(np.nanmean(data[4])),
+    'landcover': float(np.nanmean(data[5])),
+    'forecast_albedo': float(np.nanmean(data[6])),
+    'built_height': float(np.nanmean(data[7])),
+    'elevation': float(np.nanmean(data[8])),
+    'LST_1KM': float(np.nanmean(data[9]))
+    }
+    return feature_info, data
 
 @mcp.tool()
 def get_feature_info(lat: float, lon: float) -> Any:
-    # Example feature info retrieval (mocked for demonstration)
-    # tif_path = "data/LA_NDVI_SPH_2022_2023.tif"
-    tif_path = "data/feature_data_500m.tif"
-    bbox_dict = bbox_from_latlon(lat, lon)
-    bbox = bbox_dict['coordinates']
-    with rasterio.open(tif_path) as src:
-        window = from_bounds(
-            left=bbox[0],
-            bottom=bbox[1],
-            right=bbox[2],
-            top=bbox[3],
-            transform=src.transform
-        )
-
-        # Read only the bbox region
-        data = src.read(window=window)
-        feature_info = {
-        'NDVI': float(np.nanmean(data[0])),
-        'EVI': float(np.nanmean(data[1])),
-        'sph': float(np.nanmean(data[2])),
-        'pr': float(np.nanmean(data[3])),
-        'impervious_descriptor': float(np.nanmean(data[4])),
-        'landcover': float(np.nanmean(data[5])),
-        'forecast_albedo': float(np.nanmean(data[6])),
-        'built_height': float(np.nanmean(data[7])),
-        'elevation': float(np.nanmean(data[8])),
-        'LST_1KM': float(np.nanmean(data[9]))
-        }
-
-        return feature_info, data, bbox
+    window, bbox = resolve_window(lat, lon)
+    check_window(window, lat, lon)
+    feature_info, data = read_feature_window(window)
+    return feature_info, data, bbox
 
 @mcp.tool()
-def run_lst_model(feature_data: dict, feature_bands_info: dict):
+def run_lst_model(feature_data: dict, feature_bands_info: dict, quality: str="full", dtype: str=None, chunk_rows: int=None):
     """
     Run trained LST model on extracted regional features.
+    quality="preview" uses the reduced model (faster, approximate).
+    chunk_rows predicts that many image rows at a time to bound memory.
     """
     feature_order = [
         "NDVI", "EVI", "sph", "pr",
         "impervious_descriptor", "landcover", "forecast_albedo", "built_height", "elevation"
     ]
-    X = feature_data[:-1,:,:]
-    num_features, H, W = X.shape # Exclude LST band
-    X_feat = X.reshape(num_features, -1).T
+    num_bands, H, W = feature_data.shape
+    dtype = pipeline_dtype(dtype)
     missing = set(feature_order) - set(feature_bands_info.keys())
 
     if missing:
         raise ValueError(f"Missing required features: {missing}")
     
-    pred = model.predict(X_feat)
-    pred_map = pred.reshape(H, W)
+    booster = get_lst_model(quality)
+    chunk_rows = max(chunk_rows or H, 1)
+    pred_map = np.empty((H, W), dtype=dtype)
+    for row in range(0, H, chunk_rows):
+        rows = slice(row, min(row + chunk_rows, H))
+        X_feat = to_pixel_matrix(feature_data, range(num_bands - 1), dtype, rows) # Exclude LST band
+        pred_map[rows] = booster.predict(X_feat).reshape(-1, W)
     
     return {
     "data": pred_map,  # 2D list of values
-    "crs": "EPSG:3857",  # coordinate reference system
-    "units": "Kelvin"     # very important
+    "crs": get_window_resolver(FEATURE_DATA_PATH, URBAN_MASK_PATH).grid.crs,  # coordinate reference system
+    "units": "Kelvin",     # very important
+    "quality": quality
     }
 
+def estimate_uhi_effect(lat: float, lon: float, feature_name: str, change_value: dict, changes: list=None) -> dict:
+    """
+    Fast approximate what-if estimate from precomputed partial dependence
+    tables. Returns mean UHI, counterfactual UHI and delta UHI in
+    microseconds, without running the model. Only "multiply"/"divide"
+    changes are supported. Use analyze_uhi_effect for the exact answer
+    and the map layers.
+
+    :param lat: latitude of the location
+    :param lon: longitude of the location
+    :param feature_name: name of the feature to modify (same mapping as analyze_uhi_effect)
+    :param change_value: {"type": "multiply" or "divide", "value": float}
+    :param changes: optional list of extra changes, as in analyze_uhi_effect
+    """
+    _, bbox = resolve_window(lat, lon)
+    spec = normalize_counterfactual_spec(feature_name, change_value, changes)
+    try:
+        estimate = estimate_delta_uhi(bbox, spec)
+    except (FileNotFoundError, ValueError) as e:
+        return {"error": str(e), "hint": "use analyze_uhi_effect for exact inference"}
+    estimate["bbox"] = bbox
+    return estimate
+
+# the tables are an offline build (python -m mcp_agent.agents.partial_dependence),
+# so the agent is only offered the tool where they exist
+if os.path.exists(PD_TABLE_PATH):
+    mcp.tool()(estimate_uhi_effect)
+else:
+    logger.info(f"{PD_TABLE_PATH} not found, estimate_uhi_effect is not registered")
+
+@mcp.tool()
+def rank_hottest_areas(k: int=10, bbox: list=None, polygon: dict=None, layer: str="uhi", ascending: bool=False) -> dict:
+    """
+    Ranks the top-k pixels (500 m cells) of a precomputed full-extent
+    layer inside a region, e.g. "which parts of LA are hottest".
+    Layers: "uhi" (default), "lst", and "sens_<feature>" sensitivity
+    layers if built (UHI change when that feature is increased; use
+    ascending=True to find where a change would cool the most).
+
+    :param k: number of cells to return (1 to 1000)
+    :param bbox: optional [min_lon, min_lat, max_lon, max_lat]
+    :param polygon: optional GeoJSON Polygon/MultiPolygon geometry
+    :param layer: layer to rank
+    :param ascending: rank lowest values first
+    """
+    index = get_ranking_index()
+    try:
+        cells = index.top_k(layer, k, bbox=bbox, polygon=polygon, ascending=ascending)
+    except ValueError as e:
+        return {"error": str(e)}
+    return {"layer": layer, "cells": cells}
+
+@mcp.tool()
+def get_point_uhi(lat: float, lon: float, radius: int=3) -> dict:
+    """
+    Instant lookup of baseline LST (Kelvin) and UHI (°C) at a single
+    coordinate, e.g. "how hot is this address relative to its
+    surroundings". Also returns stats over the surrounding
+    (2*radius+1)^2 cells of 500 m: mean, min, max, delta (value - mean)
+    and percentile (share of neighbors cooler than this point).
+    No counterfactuals; use analyze_uhi_effect for what-if questions.
+
+    :param lat: latitude of the location
+    :param lon: longitude of the location
+    :param radius: neighborhood radius in cells (1 to 10)
+    """
+    try:
+        result = load_baseline_grid().query_points(lat, lon, radius)
+    except ValueError as e:
+        return {"error": str(e)}
+    return point_records(lat, lon, result)[0]
+
+@mcp.tool()
+def get_points_uhi(lats: list, lons: list, radius: int=3) -> Any:
+    """
+    Vectorized get_point_uhi for many coordinates in one call.
+
+    :param lats: list of latitudes
+    :param lons: list of longitudes, same length as lats
+    :param radius: neighborhood radius in cells (1 to 10)
+    """
+    try:
+        result = load_baseline_grid().query_points(lats, lons, radius)
+    except ValueError as e:
+        return {"error": str(e)}
+    return point_records(lats, lons, result)
+
 def save_numpy(path: str, array):
     if array is None:
         return
     np.save(path, array)
 
+def run_uhi_analysis(lat: float, lon: float, changes: list=None, quality: str="full", region: tuple=None,
+                     dtype: str=None) -> dict:
+    """
+    Analysis core shared by analyze_uhi_effect and the batch runner:
+    read_feature_window -> run_lst_model -> compute_uhi, plus the
+    counterfactual run when `changes` is non-empty.
+    `region` is a precomputed (window, bbox) from resolve_windows.
+    `dtype` overrides PIPELINE_DTYPE ("float32" halves the working set).
+
+    Windows over REQUEST_MEMORY_BUDGET_MB are predicted in row tiles or
+    rejected (REQUEST_MEMORY_POLICY); the traced peak is kept in the meta.
+    """
+    dtype = pipeline_dtype(dtype)
+    window, bbox = region if region is not None else resolve_window(lat, lon)
+    check_window(window, lat, lon)
+    chunk_rows = plan_chunk_rows(window.height, window.width, len(FEATURE_MAP), dtype, bool(changes))
+
+    with measure_peak_memory() as memory:
+        bands_info, features_data = read_feature_window(window, dtype)
+
+        lst_base = run_lst_model(features_data, bands_info, quality, dtype, chunk_rows)
+        uhi_base = compute_uhi(lst_base['data'], URBAN_MASK_PATH, window, dtype)
+        if changes:
+            cf_features = apply_counterfactuals(features_data, changes=changes, dtype=dtype)
+            lst_cf = run_lst_model(cf_features, bands_info, quality, dtype, chunk_rows)
+            uhi_cf = compute_uhi(lst_cf['data'], URBAN_MASK_PATH, window, dtype)
+            delta_uhi = np.subtract(uhi_cf, uhi_base, dtype=dtype)
+        else:
+            uhi_cf = None
+            delta_uhi = None
+    logger.debug(f"analysis of {window.height}x{window.width} window ({dtype.name}): peak {memory['peak_bytes']} bytes")
+    grid = get_window_resolver(FEATURE_DATA_PATH, URBAN_MASK_PATH).grid
+
+    return {
+        "lst": lst_base['data'],
+        "uhi": uhi_base,
+        "counterfactual_uhi": uhi_cf,
+        "delta_uhi": delta_uhi,
+        "bbox": bbox,
+        "meta": {"lat": lat, "lon": lon, "changes": list(changes or []), "quality": quality,
+                 "dtype": dtype.name, "peak_memory_bytes": memory["peak_bytes"],
+                 # georeferencing of the layers, in the raster's own CRS
+                 "transform": list(window_transform(window, grid.transform))[:6], "crs": grid.crs},
+    }
+
 @mcp.tool()
-def analyze_uhi_effect(lat: float, lon: float, run_id: str, redis_url: str, feature_name: str='none', change_value: dict=None, cf_data:bool=False) -> dict:
+def analyze_uhi_effect(lat: float, lon: float, run_id: str, redis_url: str, feature_name: str='none', change_value: dict=None, cf_data:bool=False, changes: list=None, quality: str="full") -> dict:
     """
     This is the final tool, any valid result should be returned, no further calling needed.
     This tool is used to calculate the Urban Heat Island(UHI) effect
@@ -231,10 +393,17 @@ def analyze_uhi_effect(lat: float, lon: float, run_id: str, redis_url: str, feat
     :param run_id: run id of the the job started.
     :param redis_url: the redis client url.
     change_value: None or {
-            "type": "divide or "multiply",
+            "type": "divide" or "multiply" or "add" or "set" or "clip",
             "value": percentage of change (e.g., 1.2 for 20% increase)
         }
     :param cf_data: True if counterfactual data is available(e.g., feature_name and change_value provided)
+    :param changes: optional list of extra changes to combine in one scenario,
+        e.g. [{"feature": "EVI", "type": "multiply", "value": 1.2},
+              {"feature": "forecast_albedo", "type": "add", "value": 0.05},
+              {"feature": "forecast_albedo", "type": "clip"}]
+        "clip" keeps the feature within its physical range.
+    :param quality: "full" (default) or "preview". Use "preview" while the user
+        is still adjusting a what-if: several times faster, approximate.
     Returns:
     dict:
         "geojson":
@@ -245,43 +414,18 @@ def analyze_uhi_effect(lat: float, lon: float, run_id: str, redis_url: str, feat
         "bbox" : list(floats)
     """
     try:
-        bands_info, features_data, bbox = get_feature_info(lat, lon)
-        urb_mask_path = "data/Rural_mask_500m.tif"
-
-        lst_base = run_lst_model(features_data, bands_info)
-        uhi_base = compute_uhi(lst_base['data'], urb_mask_path, bbox)
-        if cf_data:
-            cf_features = apply_counterfactuals(features_data, feature_name, change_value)
-            lst_cf = run_lst_model(cf_features, bands_info)
-            uhi_cf = compute_uhi(lst_cf['data'], urb_mask_path, bbox)
-            delta_uhi = uhi_cf - uhi_base
-        else:
-            uhi_cf = None
-            delta_uhi = None
-        
-        payload = {
-        "lst": lst_base['data'].tolist(),      # convert numpy arrays to lists
-        "uhi": uhi_base.tolist(),
-        "counterfactual_uhi": uhi_cf.tolist() if uhi_cf is not None else None,
-        "delta_uhi": delta_uhi.tolist() if delta_uhi is not None else None,      # scalar, ok
-        "bbox": bbox                           # dict, ok
-         }
-        print("redis url inside geocode", os.getenv("REDIS_URL"))
-        redis_client = get_redis_client(redis_url)
-        redis_client.setex(
-            f"uhi:{run_id}",
-            300,  # TTL = 5 minutes
-            json.dumps(payload)
-        )
-            
+        cf_spec = normalize_counterfactual_spec(feature_name, change_value, changes)
+        if not (cf_data or changes):
+            cf_spec = []
+        payload = run_uhi_analysis(lat, lon, cf_spec, quality)
+        get_result_store(redis_url).put(run_id, payload)
+
         return {
             "geojson": {
-                "lst": np.nanmean(lst_base['data']) if lst_base['data'] is not None else np.nan,
-                "uhi": np.nanmean(uhi_base) if uhi_base is not None else np.nan,
-                "counterfactual_uhi": np.nanmean(uhi_cf) if uhi_cf is not None else np.nan,
-                "delta_uhi": np.nanmean(delta_uhi) if delta_uhi is not None else np.nan
+                name: np.nanmean(payload[name]) if payload[name] is not None else np.nan
+                for name in ("lst", "uhi", "counterfactual_uhi", "delta_uhi")
             },
-            "bbox": bbox
+            "bbox": payload["bbox"]
         }
     except Exception as e:
         logger.error("❌ analyze_uhi_effect failed")
@@ -292,6 +436,10 @@ def analyze_uhi_effect(lat: float, lon: float, run_id: str, redis_url: str, feat
 
 def main():
     # Initialize and run the server
+    try:
+        preload_shared_state()
+    except Exception as e:
+        logger.warning(f"shared state preload failed, tools will read rasters directly: {e}")
     mcp.run(transport="stdio")
 
 
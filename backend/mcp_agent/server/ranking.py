@@ -0,0 +1,149 @@
+import logging
+from functools import lru_cache
+
+import numpy as np
+import shapely
+from shapely.errors import ShapelyError
+from shapely.geometry import shape
+
+from mcp_agent.server.baseline import BaselineGrid, load_baseline_grid
+
+logger = logging.getLogger("urbanhcf.ranking")
+
+# Regions covering less than this share of the grid are ranked directly;
+# larger ones walk the precomputed global order until k hits are found.
+DIRECT_SCAN_FRACTION = 0.1
+SCAN_CHUNK = 4096
+MAX_TOP_K = 1000
+
+
+def _region_geometry(polygon):
+    """GeoJSON Polygon/MultiPolygon (or shapely geometry) -> geometry; ValueError when malformed."""
+    if polygon is None:
+        return None
+    try:
+        geom = shape(polygon) if isinstance(polygon, dict) else polygon
+    except (ShapelyError, KeyError, TypeError, AttributeError, ValueError) as e:
+        raise ValueError(f"invalid GeoJSON polygon: {e}") from e
+    if getattr(geom, "geom_type", None) not in ("Polygon", "MultiPolygon") or geom.is_empty:
+        raise ValueError("polygon must be a non-empty GeoJSON Polygon or MultiPolygon")
+    return geom
+
+
+def _region_bbox(bbox):
+    """[min_lon, min_lat, max_lon, max_lat] as floats; ValueError when malformed."""
+    if bbox is None:
+        return None
+    try:
+        bbox = [float(v) for v in bbox]
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"invalid bbox: {e}") from e
+    if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise ValueError("bbox must be [min_lon, min_lat, max_lon, max_lat]")
+    return bbox
+
+
+class RankingIndex:
+    """
+    Top-k index over the baseline grid layers.
+
+    For every layer the valid pixels are sorted once (descending). A query
+    over a bbox or polygon either walks that order and keeps the first k
+    pixels inside the region, or, for small regions, partitions the
+    region's pixels directly.
+    """
+
+    def __init__(self, grid: BaselineGrid):
+        self.grid = grid
+        self._order = {}
+
+    def order(self, layer: str) -> np.ndarray:
+        if layer not in self._order:
+            values = self.grid.layer(layer).ravel()
+            valid = np.flatnonzero(np.isfinite(values))
+            self._order[layer] = valid[np.argsort(-values[valid], kind="stable")]
+        return self._order[layer]
+
+    def _region(self, bbox=None, polygon=None):
+        """Returns (row slice, col slice, optional boolean mask over the window)."""
+        geom = _region_geometry(polygon)
+        bbox = _region_bbox(bbox)
+        if geom is not None:
+            bbox = geom.bounds if bbox is None else bbox
+        if bbox is None:
+            return slice(0, self.grid.shape[0]), slice(0, self.grid.shape[1]), None
+
+        rows, cols = self.grid.raster_grid.slices_of_bounds(*bbox)
+        if geom is None:
+            return rows, cols, None
+
+        rr, cc = np.mgrid[rows, cols]
+        lats, lons = self.grid.raster_grid.latlon_of(rr, cc)
+        return rows, cols, shapely.contains_xy(geom, lons, lats)
+
+    def top_k(self, layer: str = "uhi", k: int = 10, bbox=None, polygon=None, ascending: bool = False) -> list:
+        """
+        k highest (or lowest with ascending=True) pixels of `layer` inside
+        a [min_lon, min_lat, max_lon, max_lat] bbox and/or GeoJSON polygon.
+        """
+        if not 1 <= k <= MAX_TOP_K:
+            raise ValueError(f"k must be between 1 and {MAX_TOP_K}, got {k}")
+        values = self.grid.layer(layer)
+        rows, cols, mask = self._region(bbox, polygon)
+        H, W = self.grid.shape
+        n_region = (rows.stop - rows.start) * (cols.stop - cols.start)
+        if n_region == 0:
+            return []
+
+        if n_region <= DIRECT_SCAN_FRACTION * H * W:
+            flat = self._top_k_direct(values, rows, cols, mask, k, ascending)
+        else:
+            flat = self._top_k_scan(layer, rows, cols, mask, k, ascending)
+
+        r, c = np.divmod(flat, W)
+        lats, lons = self.grid.raster_grid.latlon_of(r, c)
+        return [
+            {"lat": float(lat), "lon": float(lon), "row": int(ri), "col": int(ci), "value": float(values[ri, ci])}
+            for lat, lon, ri, ci in zip(lats, lons, r, c)
+        ]
+
+    def _top_k_direct(self, values, rows, cols, mask, k, ascending):
+        window = values[rows, cols]
+        keep = np.isfinite(window) if mask is None else (mask & np.isfinite(window))
+        local = np.flatnonzero(keep)
+        scores = window.ravel()[local]
+        if not ascending:
+            scores = -scores
+        if local.size > k:
+            part = np.argpartition(scores, k)[:k]
+            local, scores = local[part], scores[part]
+        local = local[np.argsort(scores, kind="stable")]
+
+        r, c = np.divmod(local, window.shape[1])
+        return (r + rows.start) * self.grid.shape[1] + (c + cols.start)
+
+    def _top_k_scan(self, layer, rows, cols, mask, k, ascending):
+        order = self.order(layer)
+        if ascending:
+            order = order[::-1]
+        W = self.grid.shape[1]
+
+        hits = []
+        found = 0
+        for start in range(0, order.size, SCAN_CHUNK):
+            chunk = order[start:start + SCAN_CHUNK]
+            r, c = np.divmod(chunk, W)
+            inside = (r >= rows.start) & (r < rows.stop) & (c >= cols.start) & (c < cols.stop)
+            if mask is not None:
+                inside[inside] = mask[r[inside] - rows.start, c[inside] - cols.start]
+            selected = chunk[inside][:k - found]
+            hits.append(selected)
+            found += selected.size
+            if found >= k:
+                break
+        return np.concatenate(hits) if hits else np.empty(0, dtype=np.int64)
+
+
+@lru_cache(maxsize=1)
+def get_ranking_index() -> RankingIndex:
+    return RankingIndex(load_baseline_grid())
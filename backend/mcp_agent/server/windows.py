@@ -0,0 +1,157 @@
+import logging
+from functools import lru_cache
+
+import numpy as np
+from pyproj import CRS, Geod, Transformer
+from rasterio.windows import Window
+
+from utils import open_raster
+
+logger = logging.getLogger("urbanhcf.windows")
+
+DEFAULT_BUFFER_KM = 3
+_GEOD = Geod(ellps="WGS84")
+
+
+class RasterGrid:
+    """Pixel grid of a raster: transform, CRS, shape and cached lat/lon transformers."""
+
+    def __init__(self, transform, crs, shape):
+        self.transform = transform
+        self.crs = crs
+        self.shape = tuple(shape)
+        self._inverse = ~transform
+        self._to_grid = Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+        self._from_grid = Transformer.from_crs(crs, "EPSG:4326", always_xy=True)
+
+    def same_grid(self, other) -> bool:
+        return (
+            self.shape == other.shape
+            and self.transform.almost_equals(other.transform)
+            and CRS.from_user_input(self.crs) == CRS.from_user_input(other.crs)
+        )
+
+    def pixel_edges(self, lons, lats):
+        """Vectorized lat/lon -> fractional (row, col) in pixel-edge coordinates."""
+        xs, ys = self._to_grid.transform(lons, lats)
+        cols, rows = self._inverse * (np.asarray(xs), np.asarray(ys))
+        return rows, cols
+
+    def lonlat_of(self, rows, cols):
+        """Vectorized pixel-edge (row, col) -> lon/lat."""
+        xs, ys = self.transform * (np.asarray(cols, dtype=np.float64), np.asarray(rows, dtype=np.float64))
+        lons, lats = self._from_grid.transform(np.asarray(xs), np.asarray(ys))
+        return np.asarray(lons), np.asarray(lats)
+
+    def pixel_of(self, lats, lons):
+        """Vectorized lat/lon -> (row, col) integer indices of the pixels containing them."""
+        rows, cols = self.pixel_edges(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+        return np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+
+    def latlon_of(self, rows, cols):
+        """Vectorized (row, col) -> lat/lon of the pixel centers."""
+        lons, lats = self.lonlat_of(np.asarray(rows) + 0.5, np.asarray(cols) + 0.5)
+        return lats, lons
+
+    def in_bounds(self, rows, cols):
+        return (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+
+    def window_of_bounds(self, min_lon, min_lat, max_lon, max_lat):
+        """
+        Vectorized lat/lon boxes -> int64 arrays row0, row1, col0, col1:
+        the box corners snapped to the nearest pixel edges and clipped, i.e.
+        the pixels whose centers fall inside the box.
+        """
+        min_lon, min_lat, max_lon, max_lat = (
+            np.atleast_1d(np.asarray(v, dtype=np.float64)) for v in (min_lon, min_lat, max_lon, max_lat)
+        )
+        corner_lons = np.concatenate([min_lon, max_lon, min_lon, max_lon])
+        corner_lats = np.concatenate([min_lat, min_lat, max_lat, max_lat])
+        rows, cols = self.pixel_edges(corner_lons, corner_lats)
+        rows, cols = rows.reshape(4, -1), cols.reshape(4, -1)
+
+        H, W = self.shape
+        row0 = np.clip(np.rint(rows.min(axis=0)), 0, H).astype(np.int64)
+        row1 = np.clip(np.rint(rows.max(axis=0)), 0, H).astype(np.int64)
+        col0 = np.clip(np.rint(cols.min(axis=0)), 0, W).astype(np.int64)
+        col1 = np.clip(np.rint(cols.max(axis=0)), 0, W).astype(np.int64)
+        return row0, np.maximum(row1, row0), col0, np.maximum(col1, col0)
+
+    def slices_of_bounds(self, min_lon, min_lat, max_lon, max_lat):
+        """window_of_bounds for one box, as (row slice, col slice)."""
+        row0, row1, col0, col1 = (int(v[0]) for v in self.window_of_bounds(min_lon, min_lat, max_lon, max_lat))
+        return slice(row0, row1), slice(col0, col1)
+
+
+@lru_cache(maxsize=None)
+def get_raster_grid(path) -> RasterGrid:
+    """Grid of a local or remote raster, read from its header once per process."""
+    with open_raster(path) as src:
+        return RasterGrid(src.transform, src.crs.to_string(), src.shape)
+
+
+class WindowResolver:
+    """
+    Resolves lat/lon points plus a buffer to integer pixel windows.
+
+    All rasters passed in must share one grid (checked on construction),
+    so a resolved window indexes the feature cube and the urban mask alike.
+    """
+
+    def __init__(self, paths):
+        self.paths = tuple(paths)
+        self.grid = get_raster_grid(self.paths[0])
+        for path in self.paths[1:]:
+            grid = get_raster_grid(path)
+            if not self.grid.same_grid(grid):
+                raise ValueError(
+                    f"{path} is not aligned with {self.paths[0]}: "
+                    f"{grid.shape} {grid.crs} {tuple(grid.transform)[:6]} vs "
+                    f"{self.grid.shape} {self.grid.crs} {tuple(self.grid.transform)[:6]}"
+                )
+
+    def resolve(self, lats, lons, buffer_km=DEFAULT_BUFFER_KM) -> dict:
+        """
+        Vectorized windows for many points. The buffer is a geodesic
+        distance (WGS84) to the north/south/east/west of each point; the
+        resulting box is snapped to the nearest pixel edges and clipped.
+
+        Returns int64 arrays row0, row1, col0, col1 and an (N, 4) array of
+        window bounds [min_lon, min_lat, max_lon, max_lat].
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        dist = np.broadcast_to(np.asarray(buffer_km, dtype=np.float64) * 1000.0, lats.shape)
+
+        # one geodesic call for all four directions of all points
+        azimuths = np.repeat([0.0, 90.0, 180.0, 270.0], lats.size)
+        end_lons, end_lats, _ = _GEOD.fwd(np.tile(lons, 4), np.tile(lats, 4), azimuths, np.tile(dist, 4))
+        end_lons, end_lats = np.asarray(end_lons).reshape(4, -1), np.asarray(end_lats).reshape(4, -1)
+        north, south = end_lats[0], end_lats[2]
+        east, west = end_lons[1], end_lons[3]
+
+        row0, row1, col0, col1 = self.grid.window_of_bounds(west, south, east, north)
+
+        edge_lons, edge_lats = self.grid.lonlat_of(
+            np.concatenate([row1, row1, row0, row0]), np.concatenate([col0, col1, col0, col1])
+        )
+        edge_lons, edge_lats = edge_lons.reshape(4, -1), edge_lats.reshape(4, -1)
+        bbox = np.stack([edge_lons.min(axis=0), edge_lats.min(axis=0),
+                         edge_lons.max(axis=0), edge_lats.max(axis=0)], axis=1)
+        return {"row0": row0, "row1": row1, "col0": col0, "col1": col1, "bbox": bbox}
+
+    def windows(self, lats, lons, buffer_km=DEFAULT_BUFFER_KM) -> list:
+        """resolve() as a list of (rasterio Window, [min_lon, min_lat, max_lon, max_lat])."""
+        r = self.resolve(lats, lons, buffer_km)
+        return [
+            (Window(int(c0), int(r0), int(c1 - c0), int(r1 - r0)), [float(v) for v in bbox])
+            for r0, r1, c0, c1, bbox in zip(r["row0"], r["row1"], r["col0"], r["col1"], r["bbox"])
+        ]
+
+    def window(self, lat, lon, buffer_km=DEFAULT_BUFFER_KM):
+        return self.windows(lat, lon, buffer_km)[0]
+
+
+@lru_cache(maxsize=None)
+def get_window_resolver(*paths) -> WindowResolver:
+    return WindowResolver(paths)
@@ -0,0 +1,25 @@
+"""Stand-in for the geocode MCP server: fixed analysis numbers, no model or rasters."""
+from mcp.server.fastmcp import FastMCP
+
+mcp = FastMCP("geocode")
+
+
+@mcp.tool()
+def analyze_uhi_effect(lat: float, lon: float, run_id: str, redis_url: str, feature_name: str = "none",
+                       change_value: dict = None, cf_data: bool = False, changes: list = None) -> dict:
+    if lat > 90:
+        raise ValueError("location outside data extent")
+    delta = -0.1 * (change_value["value"] - 1) * 10 if cf_data else None
+    return {
+        "geojson": {
+            "lst": 305.0,
+            "uhi": 1.5,
+            "counterfactual_uhi": 1.5 + delta if cf_data else None,
+            "delta_uhi": delta,
+        },
+        "bbox": [lon - 0.03, lat - 0.03, lon + 0.03, lat + 0.03],
+    }
+
+
+if __name__ == "__main__":
+    mcp.run(transport="stdio")
@@ -0,0 +1,33 @@
+import numpy as np
+import rasterio
+from affine import Affine
+
+from utils import export_results_tiff
+
+
+def test_export_uses_run_georeferencing(tmp_path):
+    # a projected (metre) grid: the lon/lat bbox alone cannot georeference it
+    transform = Affine(500.0, 0.0, -13160000.0, 0.0, -500.0, 4040000.0)
+    result = {
+        "lst": np.full((4, 5), 300.0, dtype=np.float32),
+        "uhi": np.zeros((4, 5), dtype=np.float32),
+        "bbox": [-118.22, 34.0, -118.2, 34.02],
+        "meta": {"transform": list(transform)[:6], "crs": "EPSG:3857"},
+    }
+    path = tmp_path / "run.tif"
+    export_results_tiff(str(path), result)
+
+    with rasterio.open(path) as src:
+        assert src.crs.to_string() == "EPSG:3857"
+        assert src.transform.almost_equals(transform)
+        assert src.count == 2
+
+
+def test_export_without_meta_falls_back_to_bbox(tmp_path):
+    result = {"lst": np.full((4, 5), 300.0, dtype=np.float32), "bbox": [-118.25, 34.0, -118.2, 34.04]}
+    path = tmp_path / "run.tif"
+    export_results_tiff(str(path), result)
+
+    with rasterio.open(path) as src:
+        assert src.crs.to_string() == "EPSG:4326"
+        assert np.allclose(tuple(src.bounds), result["bbox"])
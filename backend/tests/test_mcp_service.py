@@ -0,0 +1,128 @@
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("MCP_USE_ANONYMIZED_TELEMETRY", "false")
+
+import pytest
+from langchain_core.language_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage
+
+import app.result_store as result_store
+from mcp_agent.mcp_service import UrbanHCFMCPService
+from mcp_agent.plan_cache import normalize_query
+
+REDIS_URL = "redis://localhost:1"  # unreachable: results go to the disk tier
+
+
+class FakeToolChatModel(FakeMessagesListChatModel):
+    """Canned messages, tool calls included; accepts tools without binding them."""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+def answer(text):
+    return AIMessage(content=text)
+
+
+def analyze_call(run_id, lat=33.83, lon=-117.91, **args):
+    return AIMessage(content="", tool_calls=[{
+        "name": "analyze_uhi_effect", "id": f"call-{run_id}",
+        "args": {"lat": lat, "lon": lon, "run_id": run_id, "redis_url": REDIS_URL, **args},
+    }])
+
+
+def run_queries(service, *queries):
+    async def scenario():
+        try:
+            return [await service.run_query(query, run_id, REDIS_URL) for query, run_id in queries]
+        finally:
+            await service.shutdown()
+    return asyncio.run(scenario())
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = result_store.ResultStore(REDIS_URL, spill_dir=tmp_path / "results")
+    monkeypatch.setattr(result_store, "_result_store", store)
+    return store
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    server = Path(__file__).with_name("stand_in_server.py")
+    path = tmp_path / "mcp.json"
+    path.write_text(json.dumps({"mcpServers": {"geocode": {"command": sys.executable, "args": [str(server)]}}}))
+    return str(path)
+
+
+def seed_run(store, run_id, meta):
+    # what analyze_uhi_effect stores when the agent calls it
+    store.put(run_id, {"bbox": [0, 0, 1, 1], "meta": meta})
+
+
+EVI_10 = {"feature_name": "EVI", "change_value": {"type": "multiply", "value": 1.1}, "cf_data": True}
+
+
+def test_miss_hit_and_fallback(store, config_file):
+    llm = FakeToolChatModel(responses=[
+        analyze_call("r1", **EVI_10), answer("agent answer 1"),
+        answer("agent answer 2"),
+    ])
+    service = UrbanHCFMCPService(llm=llm, config_file=config_file)
+    # what the agent's analyze_uhi_effect call stores
+    seed_run(store, "r1", {"lat": 33.83, "lon": -117.91,
+                           "changes": [{"feature": "EVI", "type": "multiply", "value": 1.1}]})
+    # a cached plan that fails on the server
+    bad = normalize_query("UHI in Irvine if vegetation drops by 20%")
+    service.plan_cache.remember(bad, {"lat": 99.0, "lon": 0.0, "changes": bad.changes}, ["analyze_uhi_effect"])
+
+    first, second, third = run_queries(
+        service,
+        # miss: the agent answers and its plan is cached
+        ("UHI in Anaheim if vegetation is increased by 10%", "r1"),
+        # hit: same shape, new magnitude, served by the MCP tool without the LLM
+        ("UHI in Anaheim if vegetation is increased by 30%", "r2"),
+        # fallback: the agent answers
+        ("UHI in Irvine if vegetation drops by 10%", "r3"),
+    )
+
+    assert first == "agent answer 1"
+    assert "Anaheim" in second and "Increasing vegetation by 30%" in second
+    assert "305.0 K" in second
+    assert third == "agent answer 2"
+    assert service.plan_cache.hits == 2
+    assert llm.i == 0  # every canned message used once, the hit never reached the LLM
+
+
+def test_mismatched_agent_plan_is_not_cached(store, config_file):
+    llm = FakeToolChatModel(responses=[
+        analyze_call("r1", feature_name="EVI", change_value={"type": "multiply", "value": 1.2}, cf_data=True),
+        answer("agent answer"),
+    ])
+    service = UrbanHCFMCPService(llm=llm, config_file=config_file)
+    seed_run(store, "r1", {"lat": 33.83, "lon": -117.91,
+                           "changes": [{"feature": "EVI", "type": "multiply", "value": 1.2}]})
+
+    assert run_queries(service, ("UHI in Anaheim if vegetation is increased by 10%", "r1")) == ["agent answer"]
+    assert service.plan_cache.lookup(normalize_query("UHI in Anaheim if vegetation is increased by 50%")) is None
+
+
+def test_plan_needs_exactly_one_analysis_call(store, config_file):
+    llm = FakeToolChatModel(responses=[
+        answer("agent answer 1"),
+        analyze_call("r2"), analyze_call("r2", lat=33.7, lon=-117.8), answer("agent answer 2"),
+    ])
+    service = UrbanHCFMCPService(llm=llm, config_file=config_file)
+    # a run stored earlier under the same id, not by this query's agent
+    seed_run(store, "r1", {"lat": 33.83, "lon": -117.91, "changes": []})
+    seed_run(store, "r2", {"lat": 33.7, "lon": -117.8, "changes": []})
+
+    answers = run_queries(service, ("UHI in Anaheim", "r1"), ("UHI in Irvine", "r2"))
+
+    assert answers == ["agent answer 1", "agent answer 2"]
+    assert service.plan_cache.lookup(normalize_query("UHI in Anaheim")) is None
+    assert service.plan_cache.lookup(normalize_query("UHI in Irvine")) is None
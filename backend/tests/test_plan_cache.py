@@ -0,0 +1,75 @@
+import pytest
+
+from mcp_agent.plan_cache import ANALYZE_TOOL, PlanCache, normalize_query
+
+TOOLS = [ANALYZE_TOOL]
+
+
+@pytest.mark.parametrize("query, feature, value", [
+    ("UHI in Anaheim, if vegetation is increased by 10%", "EVI", 1.1),
+    ("UHI in Anaheim if vegetation drops by 10%", "EVI", 0.9),
+    ("What happens in Irvine if green cover declines by 30%", "EVI", 0.7),
+    ("UHI in Pasadena if rain falls by 20 percent", "pr", 0.8),
+    ("UHI in Irvine if albedo rises by 10%", "forecast_albedo", 1.1),
+    ("UHI in Irvine if trees are doubled", "EVI", 2.0),
+    ("UHI in Irvine if we halve the concrete", "impervious_descriptor", 0.5),
+])
+def test_normalize_reads_direction_and_magnitude(query, feature, value):
+    shape = normalize_query(query)
+    assert shape.cacheable
+    assert shape.feature == feature
+    assert shape.change_value == {"type": "multiply", "value": pytest.approx(value)}
+
+
+@pytest.mark.parametrize("query", [
+    "UHI in Irvine if albedo rises 10% and vegetation is reduced by 20%",  # two features
+    "plant more trees in Irvine by 20%, and reduce concrete by 50%",  # two features
+    "UHI in Irvine with vegetation at 10%",  # no direction
+    "UHI in Irvine if vegetation goes up 10% and then down",  # both directions
+    "UHI in Irvine if vegetation goes from 10% to 20%",  # two magnitudes
+    "UHI in Irvine if we cut it by 10%",  # no feature
+    "Which parts of Irvine are hottest?",  # ranking
+    "Compare UHI in Irvine and Anaheim",  # comparison
+    "How hot is 123 Main St in Irvine relative to its surroundings",  # point lookup
+    "Why is Irvine hot at night in July?",  # not a template, "July" is no location
+    "UHI in Irvine in July",  # extra qualifier
+    "What happens in Irvine?",  # no change
+])
+def test_normalize_refuses_when_unsure(query):
+    assert not normalize_query(query).cacheable
+
+
+def test_templates_key_on_intent_and_location():
+    baseline = normalize_query("What is the UHI in Los Angeles, CA?")
+    assert baseline.cacheable
+    assert baseline.key == ("analyze_uhi_effect", "los angeles, ca", None)
+    assert normalize_query("Which parts of Irvine are hottest?").intent is None
+
+
+def test_remember_requires_one_analysis_call():
+    cache = PlanCache()
+    shape = normalize_query("UHI in Irvine")
+    meta = {"lat": 33.7, "lon": -117.8, "changes": []}
+
+    assert not cache.remember(shape, meta, [])
+    assert not cache.remember(shape, meta, ["analyze_uhi_effect", "analyze_uhi_effect"])
+    assert not cache.remember(shape, meta, ["rank_hottest_areas", "analyze_uhi_effect"])
+    assert cache.lookup(shape) is None
+    assert cache.remember(shape, meta, ["analyze_uhi_effect"])
+
+
+def test_remember_requires_exact_change():
+    cache = PlanCache()
+    shape = normalize_query("UHI in Anaheim if vegetation is increased by 10%")
+    plan = {"lat": 33.8, "lon": -117.9}
+
+    assert not cache.remember(shape, {**plan, "changes": [{"feature": "EVI", "type": "multiply", "value": 1.2}]}, TOOLS)
+    assert not cache.remember(shape, {**plan, "changes": [{"feature": "EVI", "type": "add", "value": 1.1}]}, TOOLS)
+    assert not cache.remember(shape, {**plan, "changes": [
+        {"feature": "EVI", "type": "multiply", "value": 1.1},
+        {"feature": "impervious_descriptor", "type": "multiply", "value": 0.5},
+    ]}, TOOLS)
+    assert cache.lookup(shape) is None
+
+    assert cache.remember(shape, {**plan, "changes": [{"feature": "EVI", "type": "multiply", "value": 1.1}]}, TOOLS)
+    assert cache.lookup(normalize_query("UHI in Anaheim if vegetation is increased by 40%")) == plan
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from mcp_agent.server.baseline import BaselineGrid
+from mcp_agent.server.ranking import RankingIndex
+
+
+@pytest.fixture
+def index():
+    uhi = np.arange(20 * 30, dtype=np.float32).reshape(20, 30)
+    grid = BaselineGrid(arrays={
+        "transform": np.array([0.01, 0.0, -118.0, 0.0, -0.01, 34.0]),
+        "crs": np.asarray("EPSG:4326"),
+        "urban_mask": np.zeros((20, 30), dtype=np.uint8),
+        "lst": uhi + 300.0,
+        "uhi": uhi,
+    })
+    return RankingIndex(grid)
+
+
+SQUARE = {"type": "Polygon", "coordinates": [[
+    [-117.95, 33.95], [-117.85, 33.95], [-117.85, 33.85], [-117.95, 33.85], [-117.95, 33.95],
+]]}
+
+
+def test_polygon_top_k(index):
+    cells = index.top_k("uhi", 3, polygon=SQUARE)
+    assert len(cells) == 3
+    assert all(-117.95 <= c["lon"] <= -117.85 and 33.85 <= c["lat"] <= 33.95 for c in cells)
+    assert [c["value"] for c in cells] == sorted((c["value"] for c in cells), reverse=True)
+
+
+@pytest.mark.parametrize("polygon", [
+    {"type": "Polygon"},
+    {"type": "Hexagon", "coordinates": []},
+    {"coordinates": [[0, 0]]},
+    {"type": "Polygon", "coordinates": [[0, 0], [1, 1]]},
+    {"type": "Polygon", "coordinates": []},
+    {"type": "Point", "coordinates": [-117.9, 33.9]},
+])
+def test_malformed_polygon_is_a_value_error(index, polygon):
+    with pytest.raises(ValueError):
+        index.top_k("uhi", 3, polygon=polygon)
+
+
+@pytest.mark.parametrize("bbox", [[1, 2], ["a", 0, 1, 1], [-117.8, 33.8, -117.9, 33.9]])
+def test_malformed_bbox_is_a_value_error(index, bbox):
+    with pytest.raises(ValueError):
+        index.top_k("uhi", 3, bbox=bbox)
@@ -0,0 +1,117 @@
+import os
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+import utils
+
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    """Static file handler answering "Range: bytes=a-b" with 206."""
+
+    honor_range = True
+    requests_seen = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        with open(path, "rb") as f:
+            data = f.read()
+        byte_range = self.headers.get("Range")
+        self.requests_seen.append(byte_range)
+
+        if byte_range and self.honor_range:
+            start, end = (int(v) for v in byte_range.split("=")[1].split("-"))
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{start + len(body) - 1}/{len(data)}")
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _serve(directory, honor_range):
+    handler = type("Handler", (RangeHandler,), {"honor_range": honor_range, "requests_seen": []})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=str(directory)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, handler
+
+
+@pytest.fixture
+def raster(tmp_path):
+    data = np.arange(3 * 512 * 512, dtype=np.float32).reshape(3, 512, 512)
+    path = tmp_path / "cube.tif"
+    with rasterio.open(
+        path, "w", driver="GTiff", height=512, width=512, count=3, dtype="float32",
+        crs="EPSG:4326", transform=from_origin(-118.0, 34.0, 0.005, 0.005),
+        tiled=True, blockxsize=128, blockysize=128,
+    ) as dst:
+        dst.write(data)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def block_cache(tmp_path, monkeypatch):
+    cache = utils.BlockCache(cache_dir=str(tmp_path / "blocks"))
+    monkeypatch.setattr(utils, "_block_cache", cache)
+    monkeypatch.setattr(utils, "_no_range_urls", set())
+    return cache
+
+
+def test_windowed_read_matches_local(raster):
+    server, handler = _serve(raster.parent, honor_range=True)
+    url = f"http://127.0.0.1:{server.server_port}/{raster.name}"
+    window = Window(200, 100, 64, 48)
+    try:
+        with utils.open_raster(url) as src:
+            remote = src.read(window=window)
+    finally:
+        server.shutdown()
+
+    with rasterio.open(raster) as src:
+        assert np.array_equal(remote, src.read(window=window))
+    # only range requests, and less than the whole file
+    assert handler.requests_seen and all(handler.requests_seen)
+    spans = [r.split("=")[1].split("-") for r in handler.requests_seen]
+    assert sum(int(end) - int(start) + 1 for start, end in spans) < os.path.getsize(raster)
+
+
+def test_server_ignoring_range_is_detected_once(raster):
+    server, handler = _serve(raster.parent, honor_range=False)
+    url = f"http://127.0.0.1:{server.server_port}/{raster.name}"
+    try:
+        with pytest.raises(OSError, match="does not support range requests"):
+            utils.fetch_range(url, 0, 1024)
+        with pytest.raises(OSError, match="does not support range requests"):
+            utils.fetch_range(url, 1024, 2048)
+    finally:
+        server.shutdown()
+
+    assert len(handler.requests_seen) == 1
+
+
+def test_block_cache_bound_holds_across_processes(tmp_path):
+    # two instances stand in for two worker processes sharing the directory
+    caches = [utils.BlockCache(cache_dir=str(tmp_path), max_bytes=10 * 1024) for _ in range(2)]
+    for i in range(40):
+        caches[i % 2].put("http://host/cube.tif", i, bytes(1024))
+        if i >= 2:
+            # age block 0, then a hit through the other instance must refresh it
+            os.utime(caches[1]._path("http://host/cube.tif", 0), ns=(0, 0))
+            assert caches[(i + 1) % 2].get("http://host/cube.tif", 0) is not None
+
+    blocks = [e for e in os.scandir(tmp_path) if e.name.endswith(".blk")]
+    assert sum(e.stat().st_size for e in blocks) <= 10 * 1024
+    assert caches[0].get("http://host/cube.tif", 0) is not None
+    assert caches[0].get("http://host/cube.tif", 1) is None
@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+
+from app.result_store import ResultStore
+
+REDIS_URL = "redis://localhost:1"  # unreachable: results go to the disk tier only
+
+
+def payload(seed):
+    rng = np.random.default_rng(seed)
+    return {"lst": rng.random((64, 64)), "bbox": [0, 0, 1, 1], "meta": {"seed": seed}}
+
+
+def spilled(store):
+    return sorted(p.stem for p in store.spill_dir.glob("*.uhi"))
+
+
+def test_spill_byte_cap_drops_least_recently_used(tmp_path):
+    store = ResultStore(REDIS_URL, spill_dir=tmp_path, prune_interval=3600)
+    run_bytes = store.put("r0", payload(0))["stored_bytes"]
+    store.spill_max_bytes = int(3.5 * run_bytes)
+
+    for i in range(1, 3):
+        store.put(f"r{i}", payload(i))
+    for i, run_id in enumerate(spilled(store)):
+        os.utime(store.spill_dir / f"{run_id}.uhi", (i, i))
+    assert store.get("r0") is not None  # a read makes r0 the most recently used
+
+    for i in range(3, 5):
+        store.put(f"r{i}", payload(i))
+
+    assert sum(p.stat().st_size for p in store.spill_dir.glob("*.uhi")) <= store.spill_max_bytes
+    assert "r0" in spilled(store) and "r1" not in spilled(store)
+
+
+def test_ttl_pruning_is_periodic(tmp_path):
+    store = ResultStore(REDIS_URL, spill_dir=tmp_path, spill_ttl=60, prune_interval=3600)
+    store.put("old", payload(0))
+    os.utime(store.spill_dir / "old.uhi", (0, 0))
+
+    store.put("new", payload(1))
+    assert spilled(store) == ["new", "old"]  # the first put scanned; the next is not due yet
+
+    store.prune_interval = 0
+    store.put("newer", payload(2))
+    assert spilled(store) == ["new", "newer"]
@@ -0,0 +1,27 @@
+import numpy as np
+from affine import Affine
+
+from mcp_agent.server.windows import RasterGrid
+
+
+def test_window_of_bounds_round_trips_pixel_edges():
+    grid = RasterGrid(Affine(0.005, 0.0, -118.7, 0.0, -0.005, 34.4), "EPSG:4326", (323, 290))
+    row0, row1 = np.array([172, 0, 300]), np.array([184, 10, 323])
+    col0, col1 = np.array([149, 5, 280]), np.array([163, 6, 290])
+
+    lons, lats = grid.lonlat_of(np.concatenate([row1, row0]), np.concatenate([col0, col1]))
+    min_lon, max_lon = lons[:3], lons[3:]
+    min_lat, max_lat = lats[:3], lats[3:]
+    got = grid.window_of_bounds(min_lon, min_lat, max_lon, max_lat)
+
+    for actual, expected in zip(got, (row0, row1, col0, col1)):
+        assert np.array_equal(actual, expected)
+
+
+def test_pixel_of_and_latlon_of_agree():
+    grid = RasterGrid(Affine(0.005, 0.0, -118.7, 0.0, -0.005, 34.4), "EPSG:4326", (323, 290))
+    rows, cols = np.array([0, 17, 322]), np.array([0, 100, 289])
+    lats, lons = grid.latlon_of(rows, cols)
+    got_rows, got_cols = grid.pixel_of(lats, lons)
+    assert np.array_equal(got_rows, rows) and np.array_equal(got_cols, cols)
+    assert grid.in_bounds(got_rows, got_cols).all()
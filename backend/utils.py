@@ -1,15 +1,39 @@
 import numpy as np
 import rasterio
-# import gcsfs
+import fcntl
+import hashlib
+import io
+import os
+import threading
+import requests
+import shutil
+import tempfile
 import logging
 from io import BytesIO, StringIO
+from affine import Affine
 from rasterio.io import MemoryFile
-# from google.cloud import storage
+from rasterio.windows import Window
 from dataclasses import dataclass
 from typing import Any, Dict, List
 
+try:
+    import gcsfs
+except ImportError:
+    gcsfs = None
+
+try:
+    from google.cloud import storage
+except ImportError:
+    storage = None
+
 PROJECT_ID = "ai-sandbox-399505"
 
+RASTER_BLOCK_SIZE = int(os.getenv("RASTER_BLOCK_SIZE", 256 * 1024))
+RASTER_CACHE_DIR = os.getenv("RASTER_CACHE_DIR", "/tmp/urbanhcf_raster_cache")
+RASTER_CACHE_BYTES = int(os.getenv("RASTER_CACHE_BYTES", 512 * 1024 * 1024))
+EXPORT_BLOCK_SIZE = 256
+EXPORT_GDAL_CACHE_MB = 64
+
 
 @dataclass
 class TIFF():
@@ -21,6 +45,8 @@ class TIFF():
 
 def gcsfs_init():
     """ init gcs file system"""
+    if gcsfs is None:
+        raise RuntimeError("gcsfs is required for gs:// paths")
     return  gcsfs.GCSFileSystem()
 
 
@@ -44,24 +70,238 @@ def get_bucket_name(gcs_path):
 
     return bucket_name, file_path
 
-def rasterio_open(file):
+class BlockCache():
+    """
+    Size-bounded on-disk LRU cache of fixed-size byte blocks of remote
+    objects, shared by every process using the same directory. File
+    mtimes are the recency clock (bumped on each hit), and the size bound
+    is enforced from a scan of the directory under a file lock after each
+    write, so it holds across workers.
+    """
+
+    def __init__(self, cache_dir=RASTER_CACHE_DIR, max_bytes=RASTER_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, url, block_idx):
+        digest = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}_{block_idx}.blk")
+
+    def get(self, url, block_idx):
+        path = self._path(url, block_idx)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, url, block_idx, data):
+        path = self._path(url, block_idx)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._prune()
+
+    def _prune(self):
+        """Removes least recently used blocks until the directory fits in max_bytes."""
+        with open(os.path.join(self.cache_dir, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                blocks = []
+                for entry in os.scandir(self.cache_dir):
+                    if entry.name.endswith(".blk"):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        blocks.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+                size = sum(block[1] for block in blocks)
+                blocks.sort()
+                for _, block_size, path in blocks[:-1]:
+                    if size <= self.max_bytes:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    size -= block_size
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+_block_cache = None
+
+def get_block_cache():
+    global _block_cache
+
+    if _block_cache is None:
+        _block_cache = BlockCache()
+
+    return _block_cache
+
+
+def is_remote_path(path):
+    return isinstance(path, str) and path.startswith(("http://", "https://", "gs://"))
+
+
+def remote_size(url):
+    """ size in bytes of a remote object"""
+    if url.startswith("gs://"):
+        return gcsfs_init().size(url)
+    r = requests.head(url, allow_redirects=True, timeout=30)
+    if r.status_code in (403, 404):
+        raise FileNotFoundError(url)
+    r.raise_for_status()
+    return int(r.headers["Content-Length"])
+
+
+# http(s) urls whose server answered a Range request with the whole object
+_no_range_urls = set()
+
+
+def fetch_range(url, start, end):
+    """
+    fetches bytes [start, end) of a remote object. Raises OSError when
+    the server ignores Range requests rather than downloading the whole
+    object for every block; this is detected once per url.
+    """
+    if url.startswith("gs://"):
+        return gcsfs_init().cat_file(url, start=start, end=end)
+    if url in _no_range_urls:
+        raise OSError(f"{url} does not support range requests")
+    with requests.get(url, headers={"Range": f"bytes={start}-{end - 1}"}, timeout=60, stream=True) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            _no_range_urls.add(url)
+            raise OSError(f"{url} does not support range requests (got HTTP {r.status_code})")
+        return r.content
+
+
+class RangeFile(io.RawIOBase):
+    """
+    Read-only, seekable file over a remote object that fetches only the
+    blocks touched by each read, through a BlockCache.
+    """
+
+    def __init__(self, url, cache=None, block_size=RASTER_BLOCK_SIZE):
+        self.url = url
+        self.cache = cache or get_block_cache()
+        self.block_size = block_size
+        self.size = remote_size(url)
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        elif whence == io.SEEK_END:
+            self.pos = self.size + offset
+        return self.pos
+
+    def _block(self, idx):
+        data = self.cache.get(self.url, idx)
+        if data is None:
+            start = idx * self.block_size
+            data = fetch_range(self.url, start, min(start + self.block_size, self.size))
+            self.cache.put(self.url, idx, data)
+        return data
+
+    def read(self, size=-1):
+        if self.pos >= self.size:
+            return b""
+        end = self.size if size is None or size < 0 else min(self.pos + size, self.size)
+
+        chunks = []
+        for idx in range(self.pos // self.block_size, (end - 1) // self.block_size + 1):
+            block = self._block(idx)
+            block_start = idx * self.block_size
+            chunks.append(block[max(self.pos - block_start, 0):end - block_start])
+        self.pos = end
+        return b"".join(chunks)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class RemoteRasterFS():
+    """
+    Filesystem-like rasterio opener serving remote objects through
+    RangeFile. Missing objects (e.g. GDAL sidecar probes) report as
+    absent instead of failing.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def open(self, path, mode="rb"):
+        if "r" not in mode:
+            raise ValueError("remote rasters are read-only")
+        return RangeFile(path, self.cache)
+
+    def size(self, path):
+        if not is_remote_path(path):
+            raise FileNotFoundError(path)
+        return remote_size(path)
+
+    def isfile(self, path):
+        try:
+            self.size(path)
+            return True
+        except (FileNotFoundError, requests.RequestException):
+            return False
+
+    def isdir(self, path):
+        return False
+
+    def ls(self, path):
+        return []
+
+    def mtime(self, path):
+        return 0
+
+
+def open_raster(path):
+    """
+    Opens a local or remote (http(s)://, gs://) raster. Remote rasters are
+    read lazily: only the byte ranges for the requested windows are fetched.
+    """
+    if is_remote_path(path):
+        with rasterio.Env(GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR"):
+            return rasterio.open(path, opener=RemoteRasterFS())
+    return rasterio.open(path)
+
+
+def rasterio_open(file, window=None):
     """ opens a tiff file"""
-    with rasterio.open(file) as src:
-        tiff_data = src.read()  
+    src = open_raster(file) if isinstance(file, str) else rasterio.open(file)
+    with src:
+        tiff_data = src.read(window=window)  
         metadata = src.meta 
         bands = src.descriptions  
         profile = src.profile
     return TIFF(tiff_data, metadata, bands, profile)
 
 
-def load_tiff(gsc_path):
+def load_tiff(gsc_path, window=None):
     """loads a tiff object conttaining all information"""
-    gcs = gcsfs_init()
-    with gcs.open(gsc_path, 'rb') as f:
-        file_bytes = BytesIO(f.read())
-    
-    tif = rasterio_open(file_bytes)
-    return tif
+    return rasterio_open(gsc_path, window=window)
 
 def load_tif_data(gcs_tiff_path):
     """loads data present in the tiff"""
@@ -103,6 +343,102 @@ def upload_to_gcs(output_path, file):
     blob.upload_from_file(BytesIO(file), content_type="image/tiff")
     client.close() 
 
+def upload_file_to_gcs(output_path, local_path):
+    """ streams a local file to gcs bucket"""
+    client = get_storage_client()
+    bucket_name, file_path = get_bucket_name(output_path)
+    bucket = client.bucket(bucket_name)
+    blob = bucket.blob(file_path)
+    blob.upload_from_filename(local_path, content_type="image/tiff")
+    client.close()
+
+def iter_windows(height, width, block_size=EXPORT_BLOCK_SIZE):
+    """ yields block-aligned windows covering a height x width raster"""
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            yield Window(col, row, min(block_size, width - col), min(block_size, height - row))
+
+def _write_layers_local(path, layers, transform, crs, dtype, nodata, block_size):
+    names = list(layers)
+    height, width = np.shape(layers[names[0]])
+    profile = {
+        "driver": "GTiff",
+        "height": height,
+        "width": width,
+        "count": len(names),
+        "dtype": dtype,
+        "crs": crs,
+        "transform": transform,
+        "nodata": nodata,
+        "tiled": True,
+        "blockxsize": block_size,
+        "blockysize": block_size,
+        "compress": "deflate",
+        "predictor": 3 if np.dtype(dtype).kind == "f" else 2,
+        "interleave": "band",
+        "BIGTIFF": "IF_SAFER",
+    }
+    with rasterio.Env(GDAL_CACHEMAX=EXPORT_GDAL_CACHE_MB):
+        with rasterio.open(path, "w", **profile) as dst:
+            for i, name in enumerate(names, start=1):
+                dst.set_band_description(i, name)
+            for window in iter_windows(height, width, block_size):
+                rows = slice(window.row_off, window.row_off + window.height)
+                cols = slice(window.col_off, window.col_off + window.width)
+                for i, name in enumerate(names, start=1):
+                    block = np.asarray(layers[name][rows, cols], dtype=dtype)
+                    dst.write(block, i, window=window)
+
+def write_layers_tiff(out, layers, transform, crs, dtype="float32", nodata=np.nan, block_size=EXPORT_BLOCK_SIZE):
+    """
+    Writes {band name: 2D array} as one tiled, compressed multi-band
+    GeoTIFF, window by window, so only one block per band is in memory.
+    Arrays may be np.memmap or any object supporting 2D slicing.
+
+    out: local path, gs:// path or writable binary stream. Non-local
+    targets are written to a temporary file first (GTiff needs seekable
+    output) and then streamed out in chunks.
+    """
+    layers = {name: arr for name, arr in layers.items() if arr is not None}
+    if not layers:
+        raise ValueError("no layers to export")
+    if nodata is not None and np.dtype(dtype).kind != "f" and np.isnan(nodata):
+        nodata = None
+
+    if isinstance(out, str) and not out.startswith("gs://"):
+        _write_layers_local(out, layers, transform, crs, dtype, nodata, block_size)
+        logging.info(f"uploaded to {out}")
+        return out
+
+    with tempfile.NamedTemporaryFile(suffix=".tif") as tmp:
+        _write_layers_local(tmp.name, layers, transform, crs, dtype, nodata, block_size)
+        if isinstance(out, str):
+            logging.info("uploading to gcs bucket")
+            upload_file_to_gcs(out, tmp.name)
+            logging.info(f"uploaded to {out}")
+        else:
+            with open(tmp.name, "rb") as f:
+                shutil.copyfileobj(f, out, length=1024 * 1024)
+    return out
+
+def export_results_tiff(out, result, layer_names=("lst", "uhi", "counterfactual_uhi", "delta_uhi")):
+    """
+    Exports an analysis result ({layer: 2D array, "bbox", "meta"}) as a
+    multi-band GeoTIFF, one band per available layer, georeferenced with
+    the window transform and CRS recorded in the run meta. Runs stored
+    without them fall back to the lon/lat bbox in EPSG:4326.
+    """
+    layers = {name: result.get(name) for name in layer_names if result.get(name) is not None}
+    if not layers:
+        raise ValueError("result has no layers to export")
+    meta = result.get("meta") or {}
+    if meta.get("transform") is not None and meta.get("crs"):
+        transform, crs = Affine(*meta["transform"]), meta["crs"]
+    else:
+        height, width = np.shape(next(iter(layers.values())))
+        transform, crs = rasterio.transform.from_bounds(*result["bbox"], width, height), "EPSG:4326"
+    return write_layers_tiff(out, layers, transform, crs)
+
 def write_tiff(out_path: str, tiff_bytes):
     """ saves a tiff file in gcs bucket or locally"""
 
@@ -116,18 +452,20 @@ def write_tiff(out_path: str, tiff_bytes):
     logging.info(f"uploaded to {out_path}")
 
 def export_tiff(ouput_path, tgt_profile, data, band_names):
-    """creates and saves a tiff file"""
-
-    tgt_profile['count'] = len(band_names)
-    tgt_profile['driver'] = "COG"
-    with MemoryFile() as memfile:
-        with memfile.open(**tgt_profile) as dataset:
-            dataset.write(data, 1)  # Write the array to the first band
-            for i, band in enumerate(band_names, start=1):
-                dataset.set_band_description(i, band)
-        # Get the in-memory file as bytes
-        tiff_bytes = memfile.read()
-        write_tiff(ouput_path, tiff_bytes)
+    """creates and saves a tiled, compressed multi-band tiff"""
+    if data.ndim == 2:
+        data = data[np.newaxis]
+    if data.shape[0] != len(band_names):
+        raise ValueError(f"{data.shape[0]} bands but {len(band_names)} band names")
+
+    write_layers_tiff(
+        ouput_path,
+        dict(zip(band_names, data)),
+        tgt_profile['transform'],
+        tgt_profile['crs'],
+        dtype=tgt_profile.get('dtype', data.dtype),
+        nodata=tgt_profile.get('nodata'),
+    )
     return 
 
 def export_csv(df, output_path, index=False):
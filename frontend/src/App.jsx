@@ -2,6 +2,7 @@ import { useState, useEffect } from "react";
 import QueryBox from "./components/query_box";
 import MapView from "./components/map_view";
 import sampleGeoJSON from "./data/sample_uhi.json";
+import { gridToGeoJSON, GRID_JSON_MEDIA_TYPE } from "./grid";
 import ReactMarkdown from "react-markdown";
 
 const API_BASE = import.meta.env.VITE_API_BASE_URL;
@@ -50,13 +51,16 @@ export default function App() {
 
     const fetchGeoJSON = async () => {
       try {
-        const res = await fetch(`${API_BASE}/results/${runId}`);
+        const res = await fetch(`${API_BASE}/results/${runId}?encoding=int16`, {
+          headers: { Accept: GRID_JSON_MEDIA_TYPE },
+        });
         if (!res.ok) return;
 
         const data = await res.json();
+        const geojsonData = data?.grid ? gridToGeoJSON(data.grid) : data?.geojson;
 
-        if (data?.geojson) {
-          setGeojson(data.geojson);
+        if (geojsonData) {
+          setGeojson(geojsonData);
           setLoadingMap(false);
           clearInterval(intervalId);
         } else if (Date.now() - startTime > maxPollingTime) {
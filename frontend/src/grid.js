@@ -0,0 +1,58 @@
+export const GRID_JSON_MEDIA_TYPE = "application/vnd.urbanhcf.grid+json";
+
+const LAYERS = ["lst", "uhi", "counterfactual_uhi", "delta_uhi"];
+
+/** Decode one base64 layer (float32 or quantized int16) into a Float32Array */
+function decodeLayer(layer) {
+  const bytes = Uint8Array.from(atob(layer.data), (c) => c.charCodeAt(0));
+
+  if (layer.dtype === "int16") {
+    const q = new Int16Array(bytes.buffer);
+    const out = new Float32Array(q.length);
+    for (let i = 0; i < q.length; i++) {
+      out[i] = q[i] === layer.nodata ? NaN : (q[i] + 32767) * layer.scale + layer.offset;
+    }
+    return out;
+  }
+  return new Float32Array(bytes.buffer);
+}
+
+/** Rebuild the per-cell FeatureCollection from a compact grid response */
+export function gridToGeoJSON(grid) {
+  const [H, W] = grid.shape;
+  const [minLon, minLat, maxLon, maxLat] = grid.bbox;
+  const lonStep = (maxLon - minLon) / W;
+  const latStep = (maxLat - minLat) / H;
+
+  const layers = {};
+  for (const name of LAYERS) {
+    if (grid.layers[name]) layers[name] = decodeLayer(grid.layers[name]);
+  }
+
+  const value = (name, idx) => {
+    const arr = layers[name];
+    return arr && !Number.isNaN(arr[idx]) ? arr[idx] : null;
+  };
+
+  const features = [];
+  for (let i = 0; i < H; i++) {
+    for (let j = 0; j < W; j++) {
+      const x0 = minLon + j * lonStep;
+      const x1 = x0 + lonStep;
+      const y1 = maxLat - i * latStep;
+      const y0 = y1 - latStep;
+      const idx = i * W + j;
+
+      features.push({
+        type: "Feature",
+        geometry: {
+          type: "Polygon",
+          coordinates: [[[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]],
+        },
+        properties: Object.fromEntries(LAYERS.map((name) => [name, value(name, idx)])),
+      });
+    }
+  }
+
+  return { type: "FeatureCollection", features };
+}